@@ -160,6 +160,11 @@ def calculate_complexity_score(analysis: CQAnalysis) -> float:
 # --- Linguistic Feature Extraction and Scoring ---
 # -------------------------------------------------
 
+def clean_cq(cq: str) -> str:
+    """Light preprocessing before parsing: strips whitespace and trailing '?'."""
+    return cq.strip().rstrip('?')
+
+
 def get_question_type(doc: spacy.tokens.Doc) -> str:
     """Determines the type of question based on the first few tokens."""
     if not doc:
@@ -184,13 +189,15 @@ def get_question_type(doc: spacy.tokens.Doc) -> str:
     return 'OTHER' # Imperative ("Give me...") or other structures
 
 
-def analyse_linguistic_complexity(cq: str, nlp: spacy.language.Language) -> Tuple[float, Dict[str, Any]]:
+def analyse_linguistic_complexity(cq: str, nlp: spacy.language.Language,
+                                  doc: Optional[spacy.tokens.Doc] = None) -> Tuple[float, Dict[str, Any]]:
     """
     Analyzes a CQ using spaCy to extract linguistic features and calculate score.
 
     Args:
         cq: The Competency Question string.
         nlp: The loaded spaCy Language object.
+        doc: The CQ already parsed by `nlp` (e.g. with `nlp.pipe`), if any.
 
     Returns:
         A tuple containing (complexity score, dictionary of extracted features).
@@ -224,8 +231,8 @@ def analyse_linguistic_complexity(cq: str, nlp: spacy.language.Language) -> Tupl
         return 0.0, {"error": "Empty question"}
 
     # Preprocess lightly: strip whitespace and trailing question mark
-    clean_cq = cq.strip().rstrip('?')
-    doc = nlp(clean_cq)
+    if doc is None:
+        doc = nlp(clean_cq(cq))
 
     features = {}
 
@@ -301,13 +308,15 @@ def count_relevant_dependencies(doc: spacy.tokens.Doc, relevant_deps_set: Set[st
     return dict(dep_counts) # Return as standard dict
 
 
-def analyse_syntactic_complexity(cq: str, nlp: spacy.language.Language=NLP) -> Tuple[float, Dict[str, Any]]:
+def analyse_syntactic_complexity(cq: str, nlp: spacy.language.Language=NLP,
+                                 doc: Optional[spacy.tokens.Doc] = None) -> Tuple[float, Dict[str, Any]]:
     """
     Analyzes a CQ using spaCy to extract syntactic features and calculate score.
 
     Args:
         cq: The Competency Question string.
         nlp: The loaded spaCy Language object.
+        doc: The CQ already parsed by `nlp` (e.g. with `nlp.pipe`), if any.
 
     Returns:
         A tuple containing (complexity score, dictionary of extracted metrics).
@@ -344,8 +353,8 @@ def analyse_syntactic_complexity(cq: str, nlp: spacy.language.Language=NLP) -> T
         return 0.0, {"error": "Empty question"}
 
     # Preprocess lightly
-    clean_cq = cq.strip().rstrip('?')
-    doc = nlp(clean_cq)
+    if doc is None:
+        doc = nlp(clean_cq(cq))
 
     metrics = {}
 
@@ -369,3 +378,29 @@ def analyse_syntactic_complexity(cq: str, nlp: spacy.language.Language=NLP) -> T
         score += 0.1
 
     return round(score, 2), metrics
+
+
+# ------------------------------------
+# --- Batched Complexity Analysis ----
+# ------------------------------------
+
+def analyse_complexity_batch(cqs: List[str], nlp: spacy.language.Language=NLP,
+                             batch_size: int = 64) -> List[Dict[str, Any]]:
+    """
+    Computes the linguistic (c2) and syntactic (c3) complexity of many CQs,
+    parsing them in batches with `nlp.pipe` rather than one call per CQ.
+
+    Returns:
+        A list with one dictionary per CQ, with the scores and features
+        prefixed as in the complexity CSV (e.g. `c2_complexity`, `c3_tree_depth`).
+    """
+    results = []
+    docs = nlp.pipe([clean_cq(cq) if cq else "" for cq in cqs], batch_size=batch_size)
+    for cq, doc in zip(cqs, docs):
+        c2_score, c2_features = analyse_linguistic_complexity(cq, nlp, doc=doc)
+        c3_score, c3_metrics = analyse_syntactic_complexity(cq, nlp, doc=doc)
+        result = {"c2_complexity": c2_score, "c3_complexity": c3_score}
+        result.update({"c2_" + k: v for k, v in c2_features.items()})
+        result.update({"c3_" + k: v for k, v in c3_metrics.items()})
+        results.append(result)
+    return results
@@ -0,0 +1,184 @@
+"""
+Incremental CQ Coverage Tracking Module
+=======================================
+The coverage analysis in `embedding` recomputes every pair of sets from
+scratch. This module keeps, for every CQ and every other set, the running
+max similarity (and the index of the most similar CQ) so that coverage and
+novelty can be updated online as new CQ sets arrive:
+- Adding a new set only computes its similarities to the existing CQs
+  (new x existing), filling the new rows and columns of the state.
+- Appending CQs to an existing set fills the new rows, and updates the
+  columns of the other sets only where the new CQs are more similar.
+The state is persisted to disk between runs.
+"""
+import os
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from embedding import get_set_data, coverage_curves, DEFAULT_THRESHOLDS
+
+
+class CoverageTracker:
+    """
+    Running max-similarity state between CQ sets. For every ordered pair of
+    sets (covered, covering), `max_sims[(covered, covering)][i]` is the max
+    cosine similarity of CQ `i` of `covered` to any CQ of `covering`, and
+    `argmax[(covered, covering)][i]` is the index of that CQ in `covering`.
+    """
+    def __init__(self):
+        self.cqs: Dict[str, List[str]] = {}
+        self.embeddings: Dict[str, np.ndarray] = {}
+        self.max_sims: Dict[Tuple[str, str], np.ndarray] = {}
+        self.argmax: Dict[Tuple[str, str], np.ndarray] = {}
+
+    @staticmethod
+    def _normalise(embeddings) -> np.ndarray:
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, set_ids: List, embed_dim: int = 384):
+        """Creates a tracker with the sets of a DataFrame of embeddings."""
+        tracker = cls()
+        for set_id in set_ids:
+            cqs, embeddings = get_set_data(df, set_id, embed_dim=embed_dim)
+            if embeddings.size == 0:
+                print(f"Warning: No embeddings for set {set_id}. Skipping.")
+                continue
+            tracker.add_cqs(set_id, cqs, embeddings)
+        return tracker
+
+    @property
+    def set_names(self) -> List[str]:
+        return list(self.cqs)
+
+    def add_cqs(self, set_name, cqs: List[str], embeddings: np.ndarray):
+        """
+        Adds CQs to a set, creating the set if it does not exist yet. Only the
+        similarities between the new CQs and the CQs of the other sets are
+        computed: O(new x existing). Set names are stored as strings (e.g.
+        the set ids of `SET_MAPPING`), as in the persisted state.
+        """
+        set_name = str(set_name)
+        new_embeddings = self._normalise(embeddings)
+        if len(cqs) != new_embeddings.shape[0]:
+            raise ValueError(f"Got {len(cqs)} CQs but {new_embeddings.shape[0]} embeddings")
+        if new_embeddings.shape[0] == 0:
+            return
+        is_new_set = set_name not in self.cqs
+        offset = 0 if is_new_set else len(self.cqs[set_name])
+
+        for other in self.set_names:
+            if other == set_name:
+                continue
+            similarities = new_embeddings @ self.embeddings[other].T
+            row_max, row_arg = similarities.max(axis=1), similarities.argmax(axis=1)
+            col_max, col_arg = similarities.max(axis=0), similarities.argmax(axis=0) + offset
+            if is_new_set:
+                # New rows (new CQs covered by the other set) and new columns
+                self.max_sims[(set_name, other)], self.argmax[(set_name, other)] = row_max, row_arg
+                self.max_sims[(other, set_name)], self.argmax[(other, set_name)] = col_max, col_arg
+            else:
+                # Append rows; update columns only where the new CQs are closer
+                self.max_sims[(set_name, other)] = np.concatenate([self.max_sims[(set_name, other)], row_max])
+                self.argmax[(set_name, other)] = np.concatenate([self.argmax[(set_name, other)], row_arg])
+                improved = col_max > self.max_sims[(other, set_name)]
+                self.max_sims[(other, set_name)][improved] = col_max[improved]
+                self.argmax[(other, set_name)][improved] = col_arg[improved]
+
+        if is_new_set:
+            self.cqs[set_name] = list(cqs)
+            self.embeddings[set_name] = new_embeddings
+        else:
+            self.cqs[set_name].extend(cqs)
+            self.embeddings[set_name] = np.vstack([self.embeddings[set_name], new_embeddings])
+
+    # -------------------------------------------------
+    # --- Coverage from the Running State -------------
+    # -------------------------------------------------
+
+    def coverage(self, threshold: float = 0.75) -> pd.DataFrame:
+        """
+        Coverage metrics for every directional pair of sets, as in
+        `embedding.analyze_set_coverage`, computed from the running state.
+        """
+        records = []
+        for (covered, covering), max_sims in self.max_sims.items():
+            num_covered = int(np.sum(max_sims >= threshold))
+            records.append({
+                "covered": covered,
+                "covering": covering,
+                "num_cqs": len(max_sims),
+                "mean_max_similarity": np.mean(max_sims),
+                "std_max_similarity": np.std(max_sims),
+                "median_max_similarity": np.median(max_sims),
+                "num_covered": num_covered,
+                "percentage_covered": num_covered / len(max_sims) * 100,
+                "num_novel": len(max_sims) - num_covered,
+                "percentage_novel": (len(max_sims) - num_covered) / len(max_sims) * 100,
+            })
+        return pd.DataFrame(records)
+
+    def curves(self, thresholds=DEFAULT_THRESHOLDS):
+        """Coverage/novelty curves over a threshold grid (see `embedding.coverage_curves`)."""
+        return coverage_curves(self.max_sims, thresholds)
+
+    def novel_cqs(self, covered, covering, threshold: float = 0.75) -> pd.DataFrame:
+        """CQs of `covered` that are novel w.r.t. `covering`, with their closest CQ."""
+        covered, covering = str(covered), str(covering)
+        max_sims = self.max_sims[(covered, covering)]
+        argmax = self.argmax[(covered, covering)]
+        novel = np.where(max_sims < threshold)[0]
+        return pd.DataFrame({
+            "index": novel,
+            "cq": [self.cqs[covered][i] for i in novel],
+            "max_similarity": max_sims[novel],
+            "most_similar_cq": [self.cqs[covering][argmax[i]] for i in novel],
+        })
+
+    # -------------------------------------------------
+    # --- Persistence ---------------------------------
+    # -------------------------------------------------
+
+    def save(self, path: str):
+        """Saves the tracker state to a directory (JSON index and NPZ arrays)."""
+        os.makedirs(path, exist_ok=True)
+        set_index = {name: i for i, name in enumerate(self.set_names)}
+        arrays = {f"embeddings_{set_index[name]}": embeddings
+                  for name, embeddings in self.embeddings.items()}
+        for (covered, covering), max_sims in self.max_sims.items():
+            key = f"{set_index[covered]}_{set_index[covering]}"
+            arrays[f"max_sims_{key}"] = max_sims
+            arrays[f"argmax_{key}"] = self.argmax[(covered, covering)]
+        np.savez(os.path.join(path, "coverage_state.npz"), **arrays)
+        with open(os.path.join(path, "coverage_state.json"), "w") as f:
+            json.dump({"sets": self.set_names, "cqs": self.cqs,
+                       "pairs": [list(pair) for pair in self.max_sims]}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "CoverageTracker":
+        """Loads a tracker state saved with `save`."""
+        with open(os.path.join(path, "coverage_state.json"), "r") as f:
+            index = json.load(f)
+        tracker = cls()
+        set_index = {name: i for i, name in enumerate(index["sets"])}
+        with np.load(os.path.join(path, "coverage_state.npz")) as arrays:
+            for name in index["sets"]:
+                tracker.cqs[name] = index["cqs"][name]
+                tracker.embeddings[name] = arrays[f"embeddings_{set_index[name]}"]
+            for covered, covering in index["pairs"]:
+                key = f"{set_index[covered]}_{set_index[covering]}"
+                tracker.max_sims[(covered, covering)] = arrays[f"max_sims_{key}"]
+                tracker.argmax[(covered, covering)] = arrays[f"argmax_{key}"]
+        return tracker
+
+    @classmethod
+    def load_or_create(cls, path: Optional[str]) -> "CoverageTracker":
+        """Loads the tracker in `path` if it exists, or creates an empty one."""
+        if path and os.path.exists(os.path.join(path, "coverage_state.json")):
+            return cls.load(path)
+        return cls()
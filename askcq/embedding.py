@@ -4,9 +4,15 @@ The module provides functions to analyse and visualise the diversity and
 coverage of CQ embeddings from different sets. It includes functions for:
 - Internal diversity metrics (avg pairwise cosine similarity, avg distance to centroid).
 - Shannon entropy calculation based on k-means clustering.
-- Coverage analysis between different sets of embeddings.
-- PCA visualisation of embeddings.
+- Coverage analysis between different sets of embeddings, at a single
+  threshold or as coverage/novelty curves over a grid of thresholds.
+- PCA visualisation of embeddings (full, randomized or incremental PCA, with
+  scatter or hexbin rendering; see also the `projection` module).
+- Compressed embedding modes (float16, int8 scalar quantization, Matryoshka-style
+  truncation) and a report of their accuracy loss on coverage and centroids.
 """
+import itertools
+
 import pandas as pd
 import numpy as np
 
@@ -19,6 +25,8 @@ from sklearn.cluster import KMeans # For Shannon entropy via discretization
 
 import warnings
 
+from projection import fit_projection, plot_projection
+
 # Suppress specific warnings if needed
 warnings.filterwarnings("ignore", module="matplotlib\..*")
 warnings.filterwarnings("ignore", category=FutureWarning, module="sklearn") # For n_init in KMeans
@@ -53,6 +61,129 @@ def get_set_data(df, set_id, embed_dim=512):
 
     return cqs, embeddings
 
+# -------------------------------------------------
+# --- Compressed Embedding Modes ------------------
+# -------------------------------------------------
+
+EMBEDDING_PRECISIONS = ("float32", "float16", "int8")
+
+
+def truncate_embeddings(embeddings, truncate_dim):
+    """
+    Matryoshka-style truncation: keeps the first `truncate_dim` dimensions
+    and re-normalises each embedding to unit length.
+    """
+    truncated = np.asarray(embeddings, dtype=np.float32)[:, :truncate_dim]
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    return truncated / np.where(norms > 0, norms, 1.0)
+
+
+def quantize_int8(embeddings, scales=None):
+    """
+    Scalar quantization to int8 with one scale per dimension, so that each
+    dimension uses the full [-127, 127] range. Scales fitted on a reference
+    corpus can be passed to quantize further embeddings consistently.
+
+    Returns:
+        A tuple with (int8 codes, float32 per-dimension scales).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if scales is None:
+        scales = np.max(np.abs(embeddings), axis=0) / 127.0
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(embeddings / scales), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize_int8(codes, scales):
+    """Reconstructs float32 embeddings from int8 codes and per-dim scales."""
+    return codes.astype(np.float32) * scales
+
+
+def compress_embeddings(embeddings, precision="float32", truncate_dim=None, scales=None):
+    """
+    Converts embeddings to a compressed storage mode: truncation (if any) is
+    applied first, then the embeddings are cast to `precision`.
+
+    Returns:
+        The compressed embeddings, as a (codes, scales) tuple for int8.
+    """
+    if precision not in EMBEDDING_PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {EMBEDDING_PRECISIONS}")
+    if truncate_dim is not None:
+        embeddings = truncate_embeddings(embeddings, truncate_dim)
+    if precision == "int8":
+        return quantize_int8(embeddings, scales)
+    return np.asarray(embeddings, dtype=precision)
+
+
+def decompress_embeddings(compressed):
+    """Returns float32 embeddings from any compressed storage mode."""
+    if isinstance(compressed, tuple):
+        return dequantize_int8(*compressed)
+    return np.asarray(compressed, dtype=np.float32)
+
+
+def fit_int8_scales(embeddings_list, truncate_dim=None):
+    """
+    Fits the int8 per-dimension scales once on a whole corpus (e.g. all the
+    sets being compared), as an int8 embedding store would.
+    """
+    _, scales = compress_embeddings(np.vstack(embeddings_list), "int8", truncate_dim)
+    return scales
+
+
+def compress_embedding_pair(embeddings1, embeddings2, precision="float32", truncate_dim=None,
+                            scales=None):
+    """
+    Round-trips two sets of embeddings through a compressed mode and returns
+    them as float32 arrays. For int8, `scales` should be fitted on the whole
+    corpus (see `fit_int8_scales`); if not given, they are fitted on both
+    sets together so that their codes are at least comparable.
+    """
+    if precision == "int8" and scales is None:
+        scales = fit_int8_scales([embeddings1, embeddings2], truncate_dim)
+    return (decompress_embeddings(compress_embeddings(embeddings1, precision, truncate_dim, scales)),
+            decompress_embeddings(compress_embeddings(embeddings2, precision, truncate_dim, scales)))
+
+
+def compressed_cosine_similarity(embeddings1, embeddings2, precision=None, truncate_dim=None,
+                                 scales=None):
+    """
+    Cosine similarity between two sets of embeddings in a compressed mode.
+
+    With no precision and no truncation this is sklearn's float64
+    `cosine_similarity`. Otherwise similarities are computed from the
+    compressed embeddings and accumulated in float32, without upcasting.
+    """
+    if precision is None and truncate_dim is None:
+        return cosine_similarity(embeddings1, embeddings2)
+
+    a, b = compress_embedding_pair(embeddings1, embeddings2, precision or "float32",
+                                   truncate_dim, scales)
+    # Not in place: for float32 without truncation, `a` and `b` are the inputs
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return a @ b.T
+
+
+def compute_max_similarities(embeddings_covered, embeddings_covering,
+                             precision=None, truncate_dim=None, scales=None):
+    """
+    For each embedding in `embeddings_covered`, the maximum cosine similarity
+    to any embedding in `embeddings_covering` (and the index where it occurs).
+    """
+    cross_similarities = compressed_cosine_similarity(
+        embeddings_covered, embeddings_covering, precision, truncate_dim, scales)
+    return np.max(cross_similarities, axis=1), np.argmax(cross_similarities, axis=1)
+
+
+def embedding_bytes_per_vector(embed_dim, precision="float32", truncate_dim=None):
+    """Storage size of one embedding (int8 scales are shared by the corpus)."""
+    dim = truncate_dim or embed_dim
+    return dim * {"float64": 8, "float32": 4, "float16": 2, "int8": 1}[precision]
+
+
 def calculate_internal_diversity(embeddings, set_name):
     """
     Calculates internal diversity metrics for a set of embeddings.
@@ -117,10 +248,17 @@ def calculate_shannon_entropy_for_set(embeddings, set_name, n_clusters):
         return np.nan
 
 # (calculate_centroid_similarity remains the same as you provided)
-def calculate_centroid_similarity(embeddings1, embeddings2):
-    """Calculates cosine similarity between the centroids of two embedding sets."""
+def calculate_centroid_similarity(embeddings1, embeddings2, precision=None, truncate_dim=None,
+                                  scales=None):
+    """
+    Calculates cosine similarity between the centroids of two embedding sets.
+    Optionally, embeddings are first compressed (see `compress_embeddings`).
+    """
     if embeddings1.size == 0 or embeddings2.size == 0:
         return np.nan
+    if precision is not None or truncate_dim is not None:
+        embeddings1, embeddings2 = compress_embedding_pair(
+            embeddings1, embeddings2, precision or "float32", truncate_dim, scales)
     centroid1 = np.mean(embeddings1, axis=0, keepdims=True)
     centroid2 = np.mean(embeddings2, axis=0, keepdims=True)
     return cosine_similarity(centroid1, centroid2)[0][0]
@@ -129,11 +267,15 @@ def calculate_centroid_similarity(embeddings1, embeddings2):
 def analyze_set_coverage(
     cqs_covered, embeddings_covered,
     embeddings_covering, threshold,
-    set_name_covered, set_name_covering
+    set_name_covered, set_name_covering,
+    precision=None, truncate_dim=None, scales=None
 ):
     """
     Analyzes how well `embeddings_covering` cover `embeddings_covered`.
     Returns metrics including novel CQs and std dev of max similarities.
+    Similarities can be computed in a compressed mode via `precision`
+    ("float32", "float16", "int8") and/or `truncate_dim`; int8 `scales`
+    fitted on the whole corpus can be given (see `fit_int8_scales`).
     """
     num_cqs_covered = embeddings_covered.shape[0]
     results = {
@@ -160,8 +302,8 @@ def analyze_set_coverage(
         results["std_max_similarity"] = 0.0  # Or np.nan
         results["median_max_similarity"] = 0.0 # Or np.nan
     else:
-        cross_similarities = cosine_similarity(embeddings_covered, embeddings_covering)
-        max_sims_per_item = np.max(cross_similarities, axis=1)
+        max_sims_per_item, _ = compute_max_similarities(
+            embeddings_covered, embeddings_covering, precision, truncate_dim, scales)
 
         results["mean_max_similarity"] = np.mean(max_sims_per_item)
         results["std_max_similarity"] = np.std(max_sims_per_item)
@@ -186,9 +328,254 @@ def analyze_set_coverage(
 
     return results
 
+# -------------------------------------------------
+# --- Multi-threshold Coverage Curves -------------
+# -------------------------------------------------
+
+DEFAULT_THRESHOLDS = np.round(np.linspace(0.0, 1.0, 101), 2)
+
+
+def compute_pairwise_max_similarities(df, set_ids, embed_dim=384,
+                                      precision=None, truncate_dim=None):
+    """
+    Computes, in a single similarity pass, the max similarity of every CQ
+    of each set to every other set. One similarity matrix is computed per
+    unordered pair of sets and reduced along both axes, which gives the
+    two coverage directions at once. For int8, the scales are fitted once
+    on all the sets.
+
+    Returns:
+        dict: Max similarities per CQ indexed by (covered set, covering set).
+    """
+    set_embeddings = {}
+    for set_id in set_ids:
+        _, embeddings = get_set_data(df, set_id, embed_dim=embed_dim)
+        if embeddings.size == 0:
+            print(f"Warning: No embeddings for set {set_id}. Skipping.")
+            continue
+        set_embeddings[set_id] = embeddings
+
+    scales = None
+    if precision == "int8" and set_embeddings:
+        scales = fit_int8_scales(list(set_embeddings.values()), truncate_dim)
+
+    max_similarities = {}
+    for name1, name2 in itertools.combinations(set_embeddings, 2):
+        cross_similarities = compressed_cosine_similarity(
+            set_embeddings[name1], set_embeddings[name2], precision, truncate_dim, scales)
+        max_similarities[(name1, name2)] = np.max(cross_similarities, axis=1)
+        max_similarities[(name2, name1)] = np.max(cross_similarities, axis=0)
+    return max_similarities
+
+
+def coverage_curves(max_similarities, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Computes coverage and novelty at every threshold from the max
+    similarities per CQ: once these are sorted, the number of novel CQs at
+    each threshold τ (sim < τ) is a `searchsorted` lookup.
+
+    Args:
+        max_similarities: Output of `compute_pairwise_max_similarities`.
+        thresholds: The grid of similarity thresholds (τ).
+
+    Returns:
+        A tuple with two long-format DataFrames: the directional curves
+        (`covered`, `covering`, `threshold`, `num_covered`,
+        `percentage_covered`, `percentage_novel`), and the bidirectional
+        coverage curves (`set_1`, `set_2`, `threshold`,
+        `bidirectional_coverage`).
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    num_covered = {}
+    curve_frames = []
+    for (covered, covering), max_sims in max_similarities.items():
+        num_cqs = len(max_sims)
+        num_novel = np.searchsorted(np.sort(max_sims), thresholds, side="left")
+        num_covered[(covered, covering)] = num_cqs - num_novel
+        curve_frames.append(pd.DataFrame({
+            "covered": covered,
+            "covering": covering,
+            "threshold": thresholds,
+            "num_covered": num_cqs - num_novel,
+            "percentage_covered": (num_cqs - num_novel) / num_cqs * 100 if num_cqs else 0.0,
+            "percentage_novel": num_novel / num_cqs * 100 if num_cqs else 0.0,
+        }))
+
+    bidirectional_frames = []
+    seen_pairs = set()
+    for (name1, name2), covered_1_by_2 in num_covered.items():
+        if (name2, name1) not in num_covered or frozenset((name1, name2)) in seen_pairs:
+            continue  # each unordered pair once
+        seen_pairs.add(frozenset((name1, name2)))
+        num_cqs = len(max_similarities[(name1, name2)]) + len(max_similarities[(name2, name1)])
+        bidirectional_frames.append(pd.DataFrame({
+            "set_1": name1,
+            "set_2": name2,
+            "threshold": thresholds,
+            "bidirectional_coverage": (covered_1_by_2 + num_covered[(name2, name1)]) / num_cqs * 100,
+        }))
+
+    curves = pd.concat(curve_frames, ignore_index=True) if curve_frames else pd.DataFrame()
+    bidirectional = pd.concat(bidirectional_frames, ignore_index=True) \
+        if bidirectional_frames else pd.DataFrame()
+    return curves, bidirectional
+
+
+def coverage_auc(curves, value_cols=("percentage_covered", "percentage_novel"),
+                 index_cols=("covered", "covering")):
+    """
+    Area under the coverage/novelty curves, normalised by the threshold range
+    so that it reads as the average percentage over the τ grid. All the curves
+    are integrated at once with the trapezoidal rule.
+
+    Works on both outputs of `coverage_curves` (use
+    `value_cols=("bidirectional_coverage",)` and `index_cols=("set_1", "set_2")`
+    for the bidirectional curves).
+    """
+    results = {}
+    for value_col in value_cols:
+        matrix = curves.pivot_table(index=list(index_cols), columns="threshold",
+                                    values=value_col, sort=True)
+        thresholds = matrix.columns.to_numpy(dtype=float)
+        values = matrix.to_numpy()
+        widths = np.diff(thresholds)
+        areas = ((values[:, 1:] + values[:, :-1]) / 2 * widths).sum(axis=1)
+        results[f"{value_col}_auc"] = pd.Series(
+            areas / (thresholds[-1] - thresholds[0]), index=matrix.index)
+    return pd.DataFrame(results).reset_index()
+
+
+def rank_sets_by_coverage_auc(auc_df):
+    """
+    Ranks sets (generation methods) by their average coverage AUC over the
+    other sets (`covering_auc`, how much of the others they cover) and by
+    their average novelty AUC (`novelty_auc`, how much they add to others).
+    """
+    covering = auc_df.groupby("covering")["percentage_covered_auc"].mean()
+    novelty = auc_df.groupby("covered")["percentage_novel_auc"].mean()
+    ranking = pd.DataFrame({"covering_auc": covering, "novelty_auc": novelty})
+    ranking.index.name = "set"
+    return ranking.sort_values("covering_auc", ascending=False)
+
+
+# Compressed modes compared by `compare_embedding_modes` by default
+DEFAULT_EMBEDDING_MODES = [
+    {"precision": "float16"},
+    {"precision": "int8"},
+    {"truncate_dim": 256},
+    {"truncate_dim": 128},
+    {"precision": "int8", "truncate_dim": 256},
+]
+
+
+def compare_embedding_modes(df, set_ids, threshold=0.75, modes=None, embed_dim=384):
+    """
+    Reports how much each compressed embedding mode changes the coverage
+    analysis with respect to full precision (sklearn's float64 similarities).
+
+    For every mode and every directional pair of sets, it compares coverage
+    at `threshold`, the max similarities per CQ, the set of novel CQs, and the
+    centroid similarity, alongside the storage cost of the mode. For int8,
+    the scales are fitted once on all the sets, as in an int8 store.
+
+    Args:
+        df: DataFrame with `cq`, `set` and `embedding` columns.
+        set_ids: The sets to compare (values of the `set` column).
+        threshold: Similarity threshold for coverage (τ).
+        modes: List of modes, as dictionaries with optional `precision` and
+            `truncate_dim` keys. Defaults to `DEFAULT_EMBEDDING_MODES`.
+        embed_dim: Dimensionality of the full-precision embeddings.
+
+    Returns:
+        A tuple with (per-pair report DataFrame, per-mode summary DataFrame).
+    """
+    modes = modes if modes is not None else DEFAULT_EMBEDDING_MODES
+    set_embeddings = {}
+    for set_id in set_ids:
+        _, embeddings = get_set_data(df, set_id, embed_dim=embed_dim)
+        if embeddings.size == 0:
+            print(f"Warning: No embeddings for set {set_id}. Skipping.")
+            continue
+        set_embeddings[set_id] = embeddings
+
+    # Full-precision reference, computed once per pair
+    reference = {}
+    for name1, name2 in itertools.permutations(set_embeddings, 2):
+        embeddings1, embeddings2 = set_embeddings[name1], set_embeddings[name2]
+        max_sims, _ = compute_max_similarities(embeddings1, embeddings2)
+        reference[(name1, name2)] = (
+            max_sims, calculate_centroid_similarity(embeddings1, embeddings2))
+
+    records = []
+    for mode in modes:
+        precision, truncate_dim = mode.get("precision"), mode.get("truncate_dim")
+        mode_name = "/".join([precision or "float32"] +
+                             ([f"dim{truncate_dim}"] if truncate_dim else []))
+        scales = None
+        if precision == "int8":
+            scales = fit_int8_scales(list(set_embeddings.values()), truncate_dim)
+        for (name1, name2), (ref_max_sims, ref_centroid_sim) in reference.items():
+            embeddings1, embeddings2 = set_embeddings[name1], set_embeddings[name2]
+            max_sims, _ = compute_max_similarities(
+                embeddings1, embeddings2, precision, truncate_dim, scales)
+            centroid_sim = calculate_centroid_similarity(
+                embeddings1, embeddings2, precision, truncate_dim, scales)
+
+            ref_novel = set(np.where(ref_max_sims < threshold)[0])
+            novel = set(np.where(max_sims < threshold)[0])
+            novel_union = ref_novel | novel
+            records.append({
+                "mode": mode_name,
+                "covered": name1,
+                "covering": name2,
+                "coverage_full (%)": np.mean(ref_max_sims >= threshold) * 100,
+                "coverage_mode (%)": np.mean(max_sims >= threshold) * 100,
+                "max_sim_mean_abs_error": np.mean(np.abs(ref_max_sims - max_sims)),
+                "novel_changed": len(ref_novel ^ novel),
+                "novel_jaccard": len(ref_novel & novel) / len(novel_union) if novel_union else 1.0,
+                "centroid_sim_full": ref_centroid_sim,
+                "centroid_sim_mode": centroid_sim,
+                "bytes_per_vector": embedding_bytes_per_vector(embed_dim, precision or "float32", truncate_dim),
+            })
+
+    report = pd.DataFrame(records)
+    if report.empty:
+        return report, report
+    report["coverage_delta (pp)"] = report["coverage_mode (%)"] - report["coverage_full (%)"]
+    report["centroid_sim_delta"] = report["centroid_sim_mode"] - report["centroid_sim_full"]
+
+    summary = report.groupby("mode", sort=False).agg(
+        bytes_per_vector=("bytes_per_vector", "first"),
+        max_abs_coverage_delta=("coverage_delta (pp)", lambda x: np.max(np.abs(x))),
+        mean_abs_coverage_delta=("coverage_delta (pp)", lambda x: np.mean(np.abs(x))),
+        max_sim_mean_abs_error=("max_sim_mean_abs_error", "mean"),
+        novel_changed=("novel_changed", "sum"),
+        min_novel_jaccard=("novel_jaccard", "min"),
+        max_abs_centroid_delta=("centroid_sim_delta", lambda x: np.max(np.abs(x))),
+    )
+    summary.insert(1, "memory_ratio", summary["bytes_per_vector"] / (embed_dim * 4))
+
+    print(f"\n--- Compressed Embedding Modes vs Full Precision (τ={threshold}) ---")
+    print(summary.to_string(float_format=lambda x: f"{x:.4f}"))
+    return report, summary
+
+
 # Corrected visualize_all_sets_pca
-def visualize_all_sets_pca(df, set_mapping, n_components=2, embedding_col='embedding', set_col='set'):
-    """Visualizes embeddings of all sets using PCA."""
+def visualize_all_sets_pca(df, set_mapping, n_components=2, embedding_col='embedding', set_col='set',
+                          method="full", render="scatter", max_points=50_000, output_file=None,
+                          embed_dim=512):
+    """
+    Visualizes embeddings of all sets using PCA.
+
+    For large collections, `method` can be "randomized" or "incremental"
+    (see `projection.fit_projection`), and `render` can be "hexbin" (one
+    density panel per set) or a "scatter" of a density-aware sample of at
+    most `max_points` points. If `output_file` is given, the figure is saved
+    there instead of being shown. With a single component, CQs are drawn
+    along the first component only ("hexbin" needs two components).
+    """
+    if n_components < 2 and render == "hexbin":
+        raise ValueError("render='hexbin' needs n_components >= 2")
     print(f"\n--- Visualizing All Sets (PCA {n_components}D) ---")
     all_embeddings_list = []
     labels = []
@@ -197,7 +584,7 @@ def visualize_all_sets_pca(df, set_mapping, n_components=2, embedding_col='embed
 
 
     for set_id, set_name in set_mapping.items(): # Iterate through items to get both id and name
-        _, current_embeddings = get_set_data(df, set_id) # Use set_id to fetch data
+        _, current_embeddings = get_set_data(df, set_id, embed_dim=embed_dim) # Use set_id to fetch data
         if current_embeddings.size > 0:
             all_embeddings_list.append(current_embeddings)
             labels.extend([set_name] * current_embeddings.shape[0])
@@ -216,11 +603,24 @@ def visualize_all_sets_pca(df, set_mapping, n_components=2, embedding_col='embed
         print(f"Warning: Number of total samples ({all_embeddings_stack.shape[0]}) is less than or equal to n_components ({n_components}). Skipping PCA.")
         return
 
-    pca = PCA(n_components=n_components, random_state=42)
-    reduced_embeddings = pca.fit_transform(all_embeddings_stack)
+    if method == "full":
+        pca = PCA(n_components=n_components, random_state=42)
+        reduced_embeddings = pca.fit_transform(all_embeddings_stack)
+    else:
+        pca = fit_projection(all_embeddings_stack, n_components=n_components, method=method)
+        reduced_embeddings = pca.transform(all_embeddings_stack)
     explained_var_ratio = pca.explained_variance_ratio_
     print(f"Explained variance by {n_components} components: {np.sum(explained_var_ratio):.4f}")
 
+    if n_components >= 2 and (render != "scatter" or len(labels) > max_points or output_file):
+        set_names = [name for name in set_mapping.values() if name in legend_order]
+        label_index = {name: i for i, name in enumerate(set_names)}
+        plot_projection(reduced_embeddings[:, :2], np.array([label_index[l] for l in labels]),
+                        set_names, render=render, max_points=max_points,
+                        explained_variance=explained_var_ratio, output_file=output_file,
+                        title='CQ Embeddings for All Sets (PCA)')
+        return
+
     plot_df_data = {'Set': labels}
     plot_df_data['PCA1'] = reduced_embeddings[:, 0]
     if n_components >= 2:
@@ -243,4 +643,8 @@ def visualize_all_sets_pca(df, set_mapping, n_components=2, embedding_col='embed
     plt.legend(title='Set Methodology')
     plt.grid(True, linestyle='--', alpha=0.5)
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    if output_file:
+        plt.savefig(output_file)
+        plt.close()
+    else:
+        plt.show()
\ No newline at end of file
@@ -0,0 +1,350 @@
+"""
+CQ Generation Module
+====================
+This module generates competency questions (CQs) from persona descriptions and
+a user story by fanning out over a grid of LLM configurations (models, seeds
+and temperatures). Responses are consumed as streams, and CQs are parsed
+incrementally as lines arrive, then written straight into the dataset schema
+(`id, cq, set`) together with provenance columns describing the run that
+produced them.
+
+Model access is abstracted as a *stream function* with signature
+`stream_fn(model, prompt, config) -> Iterable[str]`, so the same fan-out can
+be driven by OpenAI, Gemini, or a local stub server exposing an
+OpenAI-compatible endpoint (see `openai_stream_fn(base_url=...)`, and the
+stub in `tests/stub_openai_server.py`).
+"""
+import re
+import os
+import csv
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from config import LLM_CONFIG
+from prompts import SYSTEM_ROLE_GEN, INSTRUCTION_GEN
+from utils import generate_stable_hash
+
+# Columns of `askcq_dataset.csv` that generated CQs must provide
+DATASET_FIELDS = ["id", "cq", "set"]
+# Provenance of each generated CQ (which run produced it, and where)
+PROVENANCE_FIELDS = ["model", "seed", "temperature", "config_hash", "position"]
+
+# Leading enumerations and list markers used by LLMs, e.g. "**CQ12:**",
+# "12.", "12)", "* ", "- ", "**For Sonia:**" (labels ending with a colon)
+CQ_PREFIX_PATTERN = re.compile(
+    r"^\s*(?:[-*•]\s+)?"                            # bullet
+    r"(?:\*\*)?\s*(?:CQ\s*[\d.]+|\d+)\s*[:.)]\s*(?:\*\*)?\s*"  # CQ12: / 12.
+    r"|^\s*(?:[-*•]\s+)?\*\*[^*?]{1,40}:\s*\*\*\s*"  # **For Sonia:**
+    r"|^\s*[-*•]\s+",
+    re.IGNORECASE
+)
+# Markdown emphasis markers left inside a CQ, e.g. "*Artist(s)*"
+EMPHASIS_PATTERN = re.compile(r"(\*\*|\*|__)")
+
+
+# -------------------------------------------------
+# --- Prompt and Grid Construction ----------------
+# -------------------------------------------------
+
+def read_generation_inputs(persona_files: Dict[str, str], user_story_file: str):
+    """
+    Reads the persona descriptions and the user story from markdown files.
+
+    Args:
+        persona_files: Mapping from persona name to markdown file.
+        user_story_file: Path to the markdown file with the user story.
+
+    Returns:
+        A tuple with (persona descriptions indexed by name, user story).
+    """
+    persona_descriptions = {}
+    for persona_name, persona_file in persona_files.items():
+        with open(persona_file, "r") as f:
+            persona_descriptions[persona_name] = f.read()
+    with open(user_story_file, "r") as f:
+        user_story = f.read()
+    return persona_descriptions, user_story
+
+
+def build_generation_prompt(persona_descriptions: Dict[str, str], user_story: str,
+                            instruction: str = INSTRUCTION_GEN) -> str:
+    """Combines the persona descriptions and user story into a single prompt."""
+    prompt = instruction + "\n\n[Persona Descriptions]\n"
+    for _, persona_description in persona_descriptions.items():
+        prompt += f"{persona_description}\n\n"
+    prompt += "[User Story]\n" + user_story
+    return prompt
+
+
+def build_generation_grid(models: List[str],
+                          seeds: Optional[List[int]] = None,
+                          temperatures: Optional[List[float]] = None,
+                          base_config: Dict[str, Any] = LLM_CONFIG) -> List[Dict[str, Any]]:
+    """
+    Expands models, seeds and temperatures into a list of generation runs.
+
+    Each run is a dictionary with the `model` and a full LLM `config` derived
+    from `base_config`, where only the seed and temperature are overridden.
+    Seeds and temperatures default to those in `base_config`.
+    """
+    seeds = seeds if seeds is not None else [base_config["seed"]]
+    temperatures = temperatures if temperatures is not None \
+        else [base_config["temperature"]]
+
+    grid = []
+    for model, seed, temperature in itertools.product(models, seeds, temperatures):
+        config = dict(base_config)
+        config["seed"] = seed
+        config["temperature"] = temperature
+        grid.append({"model": model, "config": config})
+    return grid
+
+
+# -------------------------------------------------
+# --- Incremental CQ Parsing ----------------------
+# -------------------------------------------------
+
+def parse_cq_line(line: str) -> Optional[str]:
+    """
+    Extracts a CQ from a single line of model output, or None if the line
+    does not contain a question (e.g. headers, blank lines, commentary).
+    """
+    text = CQ_PREFIX_PATTERN.sub("", line, count=1)
+    text = EMPHASIS_PATTERN.sub("", text).strip()
+    if "?" not in text or len(text) <= 5:
+        return None
+    return text
+
+
+class CQStreamParser:
+    """
+    Incremental parser turning a stream of text chunks into CQs. Chunks can
+    split lines arbitrarily: complete lines are parsed as soon as they are
+    available, and the last partial line is parsed on `close()`.
+    """
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        """Adds a chunk of text and returns the CQs completed by it."""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        return [cq for cq in map(parse_cq_line, lines) if cq is not None]
+
+    def close(self) -> List[str]:
+        """Flushes the remaining buffer and returns any final CQ."""
+        line, self._buffer = self._buffer, ""
+        cq = parse_cq_line(line)
+        return [cq] if cq is not None else []
+
+
+def iter_stream_cqs(chunks: Iterable[str]) -> Iterator[str]:
+    """Yields CQs from a stream of text chunks as soon as they are complete."""
+    parser = CQStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+# -------------------------------------------------
+# --- Streaming Model Backends --------------------
+# -------------------------------------------------
+
+def openai_stream_fn(api_key: Optional[str] = None, base_url: Optional[str] = None,
+                     system_role: str = SYSTEM_ROLE_GEN) -> Callable:
+    """
+    Creates a stream function for OpenAI chat completions. A `base_url` can
+    point to any OpenAI-compatible server, e.g. a local stub for testing.
+    """
+    from openai import OpenAI
+    client = OpenAI(api_key=api_key or "none", base_url=base_url)
+
+    def stream_fn(model: str, prompt: str, config: Dict[str, Any]) -> Iterator[str]:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_role},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=config["temperature"],
+            top_p=config["top_p"],
+            frequency_penalty=config["frequency_penalty"],
+            presence_penalty=config["presence_penalty"],
+            seed=config["seed"],
+            stream=True,
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    return stream_fn
+
+
+def gemini_stream_fn(api_key: str, system_role: str = SYSTEM_ROLE_GEN) -> Callable:
+    """Creates a stream function for Gemini models."""
+    from google import genai
+    from google.genai import types
+    client = genai.Client(api_key=api_key)
+
+    def stream_fn(model: str, prompt: str, config: Dict[str, Any]) -> Iterator[str]:
+        response = client.models.generate_content_stream(
+            model=model,
+            config=types.GenerateContentConfig(
+                system_instruction=system_role,
+                temperature=config["temperature"],
+                top_p=config["top_p"],
+                frequency_penalty=config["frequency_penalty"],
+                presence_penalty=config["presence_penalty"],
+                seed=config["seed"],
+            ),
+            contents=prompt,
+        )
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    return stream_fn
+
+
+# -------------------------------------------------
+# --- Fan-out and Dataset Writing -----------------
+# -------------------------------------------------
+
+class CQDatasetWriter:
+    """
+    Thread-safe writer appending generated CQs to a CSV file in the dataset
+    schema (`id, cq, set`) followed by the provenance columns. The header is
+    only written to a new (or empty) file, and an existing file must have the
+    same columns. Identifiers are assigned sequentially in order of arrival,
+    from `start_id` or, if not given, after the largest id already in the file.
+    """
+    def __init__(self, output_file: str, start_id: Optional[int] = None,
+                 fields: List[str] = DATASET_FIELDS + PROVENANCE_FIELDS):
+        last_id = 0
+        is_new = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+        if not is_new:
+            with open(output_file, "r", newline="") as f:
+                reader = csv.DictReader(f)
+                if reader.fieldnames != fields:
+                    raise ValueError(f"Cannot append to {output_file}: expected columns {fields}, "
+                                     f"found {reader.fieldnames}")
+                last_id = max((int(row["id"]) for row in reader), default=0)
+        self._lock = threading.Lock()
+        self._next_id = start_id if start_id is not None else last_id + 1
+        self._file = open(output_file, "a", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=fields,
+                                      extrasaction="ignore")
+        if is_new:
+            self._writer.writeheader()
+        self.num_written = 0
+
+    def write(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Assigns an id to the record, writes it, and returns it."""
+        with self._lock:
+            record = {"id": self._next_id, **record}
+            self._writer.writerow(record)
+            self._file.flush()
+            self._next_id += 1
+            self.num_written += 1
+        return record
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def generate_run(stream_fn: Callable, prompt: str, run: Dict[str, Any],
+                 set_id: Any, on_cq: Callable[[Dict[str, Any]], Any]) -> int:
+    """
+    Streams one generation run and calls `on_cq` with a record for every CQ
+    as soon as it is parsed. Returns the number of CQs generated.
+    """
+    model, config = run["model"], run["config"]
+    provenance = {
+        "set": set_id,
+        "model": model,
+        "seed": config["seed"],
+        "temperature": config["temperature"],
+        "config_hash": generate_stable_hash(config),
+    }
+    num_cqs = 0
+    for position, cq in enumerate(iter_stream_cqs(stream_fn(model, prompt, config))):
+        on_cq({"cq": cq, "position": position, **provenance})
+        num_cqs += 1
+    return num_cqs
+
+
+def generate_cqs(stream_fns: Dict[str, Callable], prompt: str,
+                 grid: List[Dict[str, Any]], output_file: str,
+                 set_mapping: Optional[Dict[str, Any]] = None,
+                 start_id: Optional[int] = None, max_workers: int = 8,
+                 max_retries: int = 2) -> List[Dict[str, Any]]:
+    """
+    Runs all the generation runs in `grid` concurrently and appends every
+    parsed CQ to `output_file` as soon as it arrives.
+
+    Args:
+        stream_fns: Mapping from model name to its stream function. A `"*"`
+            entry is used for models that are not listed explicitly.
+        prompt: The generation prompt (see `build_generation_prompt`).
+        grid: The generation runs (see `build_generation_grid`).
+        output_file: CSV file where the CQs are appended (created if needed).
+        set_mapping: Optional mapping from model name to the set identifier
+            written in the `set` column. Defaults to the model name.
+        start_id: First CQ identifier to assign. Defaults to continuing
+            after the largest id in `output_file` (1 for a new file).
+        max_workers: Maximum number of concurrent runs.
+        max_retries: Attempts per run if its stream fails before any CQ.
+
+    Returns:
+        A list with a summary per run (model, seed, temperature, number of
+        CQs generated, and the error message for failed runs).
+    """
+    set_mapping = set_mapping or {}
+
+    def execute(run, writer):
+        model = run["model"]
+        stream_fn = stream_fns.get(model, stream_fns.get("*"))
+        if stream_fn is None:
+            raise ValueError(f"No stream function for model '{model}'")
+        num_cqs, error = 0, None
+
+        def on_cq(record):
+            nonlocal num_cqs
+            writer.write(record)
+            num_cqs += 1
+
+        for _ in range(max_retries + 1):
+            try:
+                generate_run(stream_fn, prompt, run,
+                             set_mapping.get(model, model), on_cq)
+                error = None
+                break
+            except Exception as e:
+                error = str(e)
+                if num_cqs:  # retrying after partial output would duplicate CQs
+                    break
+        return {"model": model, "seed": run["config"]["seed"],
+                "temperature": run["config"]["temperature"],
+                "num_cqs": num_cqs, "error": error}
+
+    summaries = []
+    with CQDatasetWriter(output_file, start_id=start_id) as writer:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(execute, run, writer) for run in grid]
+            for future in as_completed(futures):
+                summary = future.result()
+                if summary["error"]:
+                    print(f"Error in run {summary['model']} (seed={summary['seed']}, "
+                          f"temperature={summary['temperature']}): {summary['error']}")
+                summaries.append(summary)
+
+    print(f"Generated {writer.num_written} CQs from {len(grid)} runs into {output_file}")
+    return summaries
@@ -0,0 +1,223 @@
+"""
+Columnar CQ Measure Store
+=========================
+The derived measures of the CQs are spread over several wide CSV files that
+overlap (`bme_cq_measures.csv`, `bme_cq_complexity.csv`,
+`bme_cq_opc_analysis.csv`, `bme_cq_readability.csv` and
+`bme_cq_relevance_ge25p_aa_score.csv`), and every notebook re-reads and
+re-parses all of them. This module merges them into a single Parquet dataset:
+- One row per CQ, keyed by the CQ `id` of `askcq_dataset.csv`.
+- Partitioned by `set` (hive layout, `set=<id>/`), with the set name stored
+  as a dictionary-encoded (categorical) column.
+- Typed columns: float32 scores, int32 counts, and the c3 dependency counts
+  as a nested `map<string, int32>` column.
+Loading supports column projection and predicate pushdown, so reading a
+single measure of a single set only touches the matching partition and
+column chunks.
+"""
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from config import SET_MAPPING
+
+# Sources of measures, merged in this order on the CQ (and set, when available)
+MEASURE_SOURCES = [
+    ("dataset", "askcq_dataset.csv"),
+    ("readability", "bme_cq_readability.csv"),
+    ("complexity", "bme_cq_complexity.csv"),
+    ("measures", "bme_cq_measures.csv"),
+    ("opc", "bme_cq_opc_analysis.csv"),
+    ("relevance", "bme_cq_relevance_ge25p_aa_score.csv"),
+]
+DEPENDENCY_COUNTS_COLUMN = "c3_relevant_dep_counts"
+PARTITIONING = ds.partitioning(pa.schema([("set", pa.int8())]), flavor="hive")
+
+
+def normalise_key(cq: str) -> str:
+    """Join key of a CQ: the text with collapsed and stripped whitespace."""
+    return " ".join(str(cq).split())
+
+
+def _same_values(a: pd.Series, b: pd.Series) -> bool:
+    """Whether two columns agree wherever both are defined."""
+    both = a.notna() & b.notna()
+    if not both.any():
+        return False
+    if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+        return bool(np.allclose(a[both].astype(float), b[both].astype(float)))
+    return bool((a[both].astype(str) == b[both].astype(str)).all())
+
+
+def load_measure_sources(data_dir: str = "../data", sources=MEASURE_SOURCES) -> pd.DataFrame:
+    """
+    Merges the measure CSVs into one DataFrame with a row per CQ. The first
+    source must provide the CQ ids. Columns that a later source shares with
+    an earlier one are dropped when they hold the same values, and suffixed
+    with the source name (e.g. `score_measures`) otherwise.
+    """
+    merged, int_columns = None, set()
+    for name, file_name in sources:
+        source_df = pd.read_csv(os.path.join(data_dir, file_name), encoding="utf-8-sig")
+        source_df["cq"] = source_df["cq"].map(normalise_key)
+        int_columns |= {c for c in source_df.columns if pd.api.types.is_integer_dtype(source_df[c])}
+        if merged is None:
+            merged = source_df
+            continue
+
+        on = ["cq", "set"] if "set" in source_df.columns else ["cq"]
+        duplicated = source_df.duplicated(on)
+        if duplicated.any():
+            print(f"Warning: dropping {duplicated.sum()} duplicated CQs in {file_name}")
+            source_df = source_df[~duplicated]
+        unmatched = ~source_df.set_index(on).index.isin(merged.set_index(on).index)
+        if unmatched.any():
+            print(f"Warning: {unmatched.sum()} CQs of {file_name} are not in {sources[0][1]}")
+
+        renames, drops = {}, []
+        aligned = merged[on].merge(source_df, on=on, how="left")
+        for column in source_df.columns.difference(on):
+            if column not in merged.columns:
+                continue
+            if _same_values(merged[column], aligned[column]):
+                drops.append(column)
+            else:
+                renames[column] = f"{column}_{name}"
+                if column in int_columns:
+                    int_columns.add(renames[column])
+        source_df = source_df.drop(columns=drops).rename(columns=renames)
+        merged = merged.merge(source_df, on=on, how="left")
+
+    for column in int_columns & set(merged.columns):
+        merged[column] = merged[column].astype("Int32")
+    return merged
+
+
+def compute_dependency_counts(cqs: List[str]) -> List[Dict[str, int]]:
+    """Counts of the relevant dependencies of each CQ (see `complexity`)."""
+    from complexity import analyse_complexity_batch
+    return [result["c3_relevant_dep_counts"] for result in analyse_complexity_batch(cqs)]
+
+
+def to_measure_table(measures_df: pd.DataFrame, set_mapping=SET_MAPPING) -> pa.Table:
+    """
+    Converts merged measures to an Arrow table with the store types: int8
+    set, categorical set name, float32 floats, int32 integers, strings, and
+    the dependency counts (if any) as a map column.
+    """
+    measures_df = measures_df.sort_values("id")
+    fields, arrays = [], []
+    for column in measures_df.columns:
+        values = measures_df[column]
+        if column == "set":
+            field, array = pa.field("set", pa.int8()), pa.array(values, pa.int8())
+        elif column == DEPENDENCY_COUNTS_COLUMN:
+            field = pa.field(column, pa.map_(pa.string(), pa.int32()))
+            array = pa.array([None if not isinstance(counts, dict) else list(counts.items())
+                              for counts in values], field.type)
+        elif isinstance(values.dtype, pd.Int32Dtype) or pd.api.types.is_integer_dtype(values):
+            field, array = pa.field(column, pa.int32()), pa.array(values, pa.int32(), from_pandas=True)
+        elif pd.api.types.is_float_dtype(values):
+            field, array = pa.field(column, pa.float32()), pa.array(values, pa.float32(), from_pandas=True)
+        else:
+            strings = [None if pd.isna(value) else str(value) for value in values]
+            field, array = pa.field(column, pa.string()), pa.array(strings, pa.string())
+        fields.append(field)
+        arrays.append(array)
+
+    set_names = pa.array([set_mapping.get(s, str(s)) for s in measures_df["set"]]).dictionary_encode()
+    fields.insert(3, pa.field("set_name", set_names.type))
+    arrays.insert(3, set_names)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def build_measure_store(store_dir: str, data_dir: str = "../data", sources=MEASURE_SOURCES,
+                        dependency_counts: Optional[List[Dict[str, int]]] = None,
+                        set_mapping=SET_MAPPING) -> pa.Table:
+    """
+    Builds (or rebuilds) the measure store from the CSV sources.
+
+    Args:
+        store_dir: Directory of the Parquet dataset.
+        data_dir: Directory with the source CSV files.
+        sources: List of (name, file) sources, see `MEASURE_SOURCES`.
+        dependency_counts: Relevant dependency counts of each CQ, in the
+            order of the first source (e.g. from `compute_dependency_counts`).
+        set_mapping: Mapping from set ids to set names.
+
+    Returns:
+        The Arrow table that was written.
+    """
+    measures_df = load_measure_sources(data_dir, sources)
+    if dependency_counts is not None:
+        if len(dependency_counts) != len(measures_df):
+            raise ValueError(f"Got {len(dependency_counts)} dependency counts for {len(measures_df)} CQs")
+        measures_df[DEPENDENCY_COUNTS_COLUMN] = dependency_counts
+    table = to_measure_table(measures_df, set_mapping)
+    ds.write_dataset(table, store_dir, format="parquet", partitioning=PARTITIONING,
+                     existing_data_behavior="delete_matching")
+    print(f"Measure store written to {store_dir}: {table.num_rows} CQs, {table.num_columns} columns")
+    return table
+
+
+def _set_ids(sets, set_mapping=SET_MAPPING) -> List[int]:
+    """Set ids from ids or names."""
+    ids_by_name = {name: set_id for set_id, name in set_mapping.items()}
+    return [ids_by_name[s] if isinstance(s, str) else int(s) for s in sets]
+
+
+def load_measures(store_dir: str, columns: Optional[List[str]] = None, sets=None,
+                  filters=None, set_mapping=SET_MAPPING) -> pd.DataFrame:
+    """
+    Loads measures from the store, indexed by CQ id.
+
+    Args:
+        store_dir: Directory of the Parquet dataset.
+        columns: Columns to read (all if None); `id` is always read.
+        sets: Set ids or names to read (all if None); pruned by partition.
+        filters: Additional predicate, either a `pyarrow.dataset` expression
+            or a list of (column, op, value) tuples as in `pyarrow.parquet`.
+        set_mapping: Mapping from set ids to set names.
+
+    Returns:
+        A DataFrame with the requested columns.
+    """
+    dataset = ds.dataset(store_dir, format="parquet", partitioning=PARTITIONING)
+    expression = None
+    if sets is not None:
+        expression = ds.field("set").isin(_set_ids(sets, set_mapping))
+    if filters is not None:
+        if not isinstance(filters, ds.Expression):
+            filters = pq.filters_to_expression(filters)
+        expression = filters if expression is None else expression & filters
+    if columns is not None:
+        columns = ["id"] + [c for c in columns if c != "id"]
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    measures_df = table.to_pandas()
+    if DEPENDENCY_COUNTS_COLUMN in measures_df.columns:
+        measures_df[DEPENDENCY_COUNTS_COLUMN] = measures_df[DEPENDENCY_COUNTS_COLUMN].map(
+            lambda counts: dict(counts) if counts is not None else None)
+    return measures_df.set_index("id").sort_index()
+
+
+def describe_store(store_dir: str) -> pd.DataFrame:
+    """Rows and bytes of each partition file of the store."""
+    records = []
+    for root, _, files in os.walk(store_dir):
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            metadata = pq.read_metadata(path)
+            records.append({
+                "partition": os.path.relpath(root, store_dir),
+                "file": file_name,
+                "num_rows": metadata.num_rows,
+                "num_row_groups": metadata.num_row_groups,
+                "bytes": os.path.getsize(path),
+            })
+    return pd.DataFrame(records).sort_values("partition").reset_index(drop=True)
@@ -0,0 +1,276 @@
+"""
+ONNX CPU Embedding Backend
+==========================
+An optional backend for the local sentence embeddings of the CQs, as an
+alternative to `SentenceTransformer('all-MiniLM-L6-v2').encode(...)` on CPU:
+- The model is exported once to ONNX and quantized to int8 weights
+  (`export_onnx_model`, which needs `torch` and `transformers`).
+- Inference only needs `onnxruntime` and `tokenizers`. CQs are tokenized
+  in a thread pool, sorted by token length and batched so that each batch
+  is padded only to its own longest CQ, instead of padding short and long
+  CQs together.
+- Embeddings are mean-pooled and L2-normalised as in the sentence-transformers
+  model, so they can be compared with `cq_embeddings_sbert.pkl`.
+
+The report compares the throughput with the PyTorch path (when available)
+and the cosine agreement with the existing embeddings:
+
+    python onnx_embedding.py export --output ../data/embeddings/onnx
+    python onnx_embedding.py report --model-dir ../data/embeddings/onnx
+"""
+import os
+import time
+import pickle
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_REFERENCE = "../data/embeddings/cq_embeddings_sbert.pkl"
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+# -------------------------------------------------
+# --- Export and Quantization ---------------------
+# -------------------------------------------------
+
+def export_onnx_model(output_dir: str, model_name: str = DEFAULT_MODEL,
+                      quantize: bool = True, opset: int = 14) -> str:
+    """
+    Exports the transformer of a sentence-transformers model to ONNX, with
+    dynamic batch and sequence axes, and quantizes its weights to int8.
+
+    Args:
+        output_dir: Directory for the ONNX models and the tokenizer.
+        model_name: Hugging Face name of the model.
+        quantize: Whether to also write the int8 model.
+        opset: ONNX opset version.
+
+    Returns:
+        The path of the model to use (int8 if quantized).
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(output_dir)
+
+    inputs = tokenizer(["What is the name of an item?"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in inputs]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(inputs[name] for name in input_names), model_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    print(f"Exported {model_name} to {model_path}")
+    if not quantize:
+        return model_path
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = os.path.join(output_dir, ONNX_INT8_MODEL_FILE)
+    quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"Quantized model written to {int8_path} "
+          f"({os.path.getsize(model_path) / 1e6:.1f} MB -> {os.path.getsize(int8_path) / 1e6:.1f} MB)")
+    return int8_path
+
+
+# -------------------------------------------------
+# --- Length-bucketed Batching --------------------
+# -------------------------------------------------
+
+def length_bucketed_batches(lengths: List[int], batch_size: int) -> List[np.ndarray]:
+    """
+    Indices of the inputs grouped in batches of similar length: the inputs
+    are sorted by length, and consecutive runs of `batch_size` form a batch.
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def pad_batch(sequences: List[List[int]], pad_id: int = 0) -> np.ndarray:
+    """Pads token sequences to the longest one in the batch."""
+    batch = np.full((len(sequences), max(len(s) for s in sequences)), pad_id, dtype=np.int64)
+    for i, sequence in enumerate(sequences):
+        batch[i, :len(sequence)] = sequence
+    return batch
+
+
+def mean_pooling(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Mean of the token embeddings over the non-padding tokens."""
+    mask = attention_mask[..., None].astype(np.float32)
+    return (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+
+class OnnxSentenceEncoder:
+    """
+    Sentence encoder running an exported ONNX model on CPU. `encode` follows
+    the signature of `SentenceTransformer.encode`, so it can be used in its
+    place (e.g. in `serve.ScoringModels`).
+    """
+    def __init__(self, model_dir: str, model_file: str = ONNX_INT8_MODEL_FILE,
+                 batch_size: int = 32, max_length: int = 256,
+                 num_threads: Optional[int] = None, tokenizer_workers: int = 4):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer_workers = tokenizer_workers
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def tokenize(self, sentences: List[str]):
+        """Tokenizes the sentences in chunks over a thread pool."""
+        if self.tokenizer_workers <= 1 or len(sentences) <= self.batch_size:
+            return self.tokenizer.encode_batch(sentences)
+        chunk_size = -(-len(sentences) // self.tokenizer_workers)
+        chunks = [sentences[start:start + chunk_size] for start in range(0, len(sentences), chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.tokenizer_workers) as executor:
+            return [encoding for encodings in executor.map(self.tokenizer.encode_batch, chunks)
+                    for encoding in encodings]
+
+    def _run_batch(self, encodings) -> np.ndarray:
+        feeds = {"input_ids": pad_batch([e.ids for e in encodings]),
+                 "attention_mask": pad_batch([e.attention_mask for e in encodings])}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = pad_batch([e.type_ids for e in encodings])
+        token_embeddings = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        return mean_pooling(token_embeddings, feeds["attention_mask"])
+
+    def encode(self, sentences, batch_size: Optional[int] = None, normalize_embeddings: bool = True,
+               convert_to_numpy: bool = True, device: str = "cpu", **kwargs) -> np.ndarray:
+        """Embeds the sentences, returned in their input order."""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        encodings = self.tokenize(sentences)
+        embeddings = None
+        for batch in length_bucketed_batches([len(e.ids) for e in encodings], batch_size or self.batch_size):
+            batch_embeddings = self._run_batch([encodings[i] for i in batch])
+            if embeddings is None:
+                embeddings = np.empty((len(sentences), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch] = batch_embeddings
+        if embeddings is None:
+            return np.empty((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+# -------------------------------------------------
+# --- Throughput and Agreement Report -------------
+# -------------------------------------------------
+
+def load_reference_embeddings(reference_file: str = DEFAULT_REFERENCE):
+    """CQs and embeddings of `cq_embeddings_sbert.pkl`."""
+    with open(reference_file, "rb") as f:
+        reference_df = pd.DataFrame(pickle.load(f))
+    return reference_df["cq"].tolist(), np.vstack(reference_df["embedding"].to_numpy()).astype(np.float32)
+
+
+def benchmark_encoders(encode_fns: Dict[str, Callable], sentences: List[str],
+                       repeats: int = 3) -> pd.DataFrame:
+    """Throughput of each encode function (best of `repeats` runs, after a warm-up)."""
+    results = []
+    for name, encode_fn in encode_fns.items():
+        encode_fn(sentences[:8])
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            encode_fn(sentences)
+            timings.append(time.perf_counter() - start)
+        results.append({"backend": name, "num_cqs": len(sentences), "seconds": min(timings),
+                        "cqs_per_second": len(sentences) / min(timings)})
+    results = pd.DataFrame(results)
+    results["speedup"] = results["cqs_per_second"] / results["cqs_per_second"].iloc[0]
+    return results
+
+
+def cosine_agreement(embeddings: np.ndarray, reference: np.ndarray) -> Dict[str, float]:
+    """
+    Agreement between two embeddings of the same CQs: row-wise cosine
+    similarities, and how often the nearest neighbour of each CQ is the same.
+    """
+    a = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    b = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    cosines = np.sum(a * b, axis=1)
+    sims_a, sims_b = a @ a.T, b @ b.T
+    np.fill_diagonal(sims_a, -np.inf)
+    np.fill_diagonal(sims_b, -np.inf)
+    return {
+        "mean_cosine": float(np.mean(cosines)),
+        "min_cosine": float(np.min(cosines)),
+        "p01_cosine": float(np.percentile(cosines, 1)),
+        "nearest_neighbour_agreement": float(np.mean(sims_a.argmax(axis=1) == sims_b.argmax(axis=1))),
+    }
+
+
+def report_onnx_backend(model_dir: str, reference_file: str = DEFAULT_REFERENCE,
+                        model_name: str = DEFAULT_MODEL, repeats: int = 3, **encoder_kwargs):
+    """
+    Prints and returns the throughput of the ONNX backends (fp32 and int8,
+    when exported) against the PyTorch path, and their cosine agreement with
+    the reference embeddings.
+    """
+    cqs, reference = load_reference_embeddings(reference_file)
+    encode_fns = {}
+    try:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device="cpu")
+        encode_fns["pytorch"] = lambda s: model.encode(s, convert_to_numpy=True, device="cpu")
+    except Exception as e:
+        print(f"Warning: PyTorch baseline not available ({e}).")
+    for name, model_file in (("onnx_fp32", ONNX_MODEL_FILE), ("onnx_int8", ONNX_INT8_MODEL_FILE)):
+        if os.path.exists(os.path.join(model_dir, model_file)):
+            encoder = OnnxSentenceEncoder(model_dir, model_file, **encoder_kwargs)
+            encode_fns[name] = encoder.encode
+
+    throughput = benchmark_encoders(encode_fns, cqs, repeats)
+    agreement = pd.DataFrame([{"backend": name, **cosine_agreement(encode_fn(cqs), reference)}
+                              for name, encode_fn in encode_fns.items()])
+    report = throughput.merge(agreement, on="backend")
+    print(f"\n--- Embedding Backends ({len(cqs)} CQs) ---")
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX CPU backend for CQ sentence embeddings.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export and quantize the model to ONNX.")
+    export_parser.add_argument("--output", required=True)
+    export_parser.add_argument("--model", default=DEFAULT_MODEL)
+    export_parser.add_argument("--no-quantize", action="store_true")
+    report_parser = subparsers.add_parser("report", help="Throughput and agreement report.")
+    report_parser.add_argument("--model-dir", required=True)
+    report_parser.add_argument("--reference", default=DEFAULT_REFERENCE)
+    report_parser.add_argument("--model", default=DEFAULT_MODEL)
+    report_parser.add_argument("--batch-size", type=int, default=32)
+    report_parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx_model(args.output, args.model, quantize=not args.no_quantize)
+    else:
+        report_onnx_backend(args.model_dir, args.reference, args.model,
+                            batch_size=args.batch_size, num_threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Multi-story Partitioning Module
+===============================
+The original analysis covers a single user story (`bme_us1.md`) with its
+personas and the five sets in `config.SET_MAPPING`. This module makes the
+user story a first-class partition of the work, grouped by project, and
+schedules the analyses of many partitions over a process pool:
+- Per-CQ measures (readability, complexity) are split into chunks of CQs, so
+  that large partitions do not end up on a single worker.
+- Per-set measures (embedding diversity) and pairwise coverage run once per
+  partition.
+- Tasks are dispatched largest first from a shared queue, and idle workers
+  pull the next task as soon as they finish one, which balances skewed
+  partition sizes.
+Results are merged into indexed DataFrames with per-partition and global
+aggregates.
+
+A directory of partitions is laid out as `<root>/<project>/<story_id>/` with
+a `user_story.md`, any number of `persona_<name>.md` files, a `cqs.csv` (with
+at least the `cq` and `set` columns), and optionally an `embeddings.pkl`
+(list of dictionaries with `cq`, `set` and `embedding`, as produced by
+`cq_embeddings.ipynb`) and a `sets.json` mapping set ids to names.
+"""
+import io
+import os
+import glob
+import json
+import pickle
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field
+
+from config import SET_MAPPING
+
+ANALYSES = ("readability", "complexity", "embedding", "coverage")
+# Analyses computed per CQ, which can be split into chunks of CQs
+PER_CQ_ANALYSES = ("readability", "complexity")
+PARTITION_INDEX = ["project", "story_id"]
+ERROR_COLUMNS = PARTITION_INDEX + ["analysis", "start", "stop", "error"]
+
+
+class StoryPartition(BaseModel):
+    """A user story of a project, with its personas, CQs and embeddings."""
+    project: str = Field(description="Project the user story belongs to.")
+    story_id: str = Field(description="Identifier of the user story within the project.")
+    user_story_file: str = Field(description="Markdown file with the user story.")
+    persona_files: Dict[str, str] = Field(
+        description="Markdown files with the persona descriptions, indexed by persona name.",
+        default_factory=dict
+    )
+    cq_file: str = Field(description="CSV file with the CQs (at least `cq` and `set` columns).")
+    embeddings_file: Optional[str] = Field(
+        description="Pickle file with the CQ embeddings (list of dicts with `cq`, `set`, `embedding`).",
+        default=None
+    )
+    set_mapping: Dict[int, str] = Field(
+        description="Mapping from set ids to set names.",
+        default_factory=lambda: dict(SET_MAPPING)
+    )
+
+    @property
+    def key(self) -> str:
+        return f"{self.project}/{self.story_id}"
+
+    def load_cqs(self) -> pd.DataFrame:
+        """Loads the CQs, adding the `set_name` column from the set mapping."""
+        cq_df = pd.read_csv(self.cq_file, encoding="utf-8-sig")
+        cq_df["set_name"] = cq_df["set"].map(lambda s: self.set_mapping.get(s, str(s)))
+        return cq_df
+
+    def load_embeddings(self) -> Optional[pd.DataFrame]:
+        """Loads the embeddings, with set ids mapped to set names if needed."""
+        if not self.embeddings_file:
+            return None
+        with open(self.embeddings_file, "rb") as f:
+            embeddings_df = pd.DataFrame(pickle.load(f))
+        embeddings_df["set"] = embeddings_df["set"].map(lambda s: self.set_mapping.get(s, s))
+        embeddings_df["embedding"] = embeddings_df["embedding"].apply(
+            lambda e: np.asarray(e, dtype=np.float32))
+        return embeddings_df
+
+    def num_cqs(self) -> int:
+        """Number of CQs in the partition (used to size and order the tasks)."""
+        return len(pd.read_csv(self.cq_file, usecols=["cq"], encoding="utf-8-sig"))
+
+
+def default_partition(data_dir: str = "../data") -> StoryPartition:
+    """The partition of the original study: the BME user story (`bme_us1.md`)."""
+    return StoryPartition(
+        project="bme",
+        story_id="us1",
+        user_story_file=os.path.join(data_dir, "bme_us1.md"),
+        persona_files={
+            "sonia": os.path.join(data_dir, "bme_persona_sonia.md"),
+            "liz": os.path.join(data_dir, "bme_persona_liz.md"),
+        },
+        cq_file=os.path.join(data_dir, "askcq_dataset.csv"),
+        embeddings_file=os.path.join(data_dir, "embeddings", "cq_embeddings_sbert.pkl"),
+    )
+
+
+def discover_partitions(root: str) -> List[StoryPartition]:
+    """Finds all the partitions under `root` (see the module docstring for the layout)."""
+    partitions = []
+    for story_dir in sorted(glob.glob(os.path.join(root, "*", "*"))):
+        cq_file = os.path.join(story_dir, "cqs.csv")
+        user_story_file = os.path.join(story_dir, "user_story.md")
+        if not (os.path.isfile(cq_file) and os.path.isfile(user_story_file)):
+            continue
+        project = os.path.basename(os.path.dirname(story_dir))
+        persona_files = {
+            os.path.basename(f)[len("persona_"):-len(".md")]: f
+            for f in sorted(glob.glob(os.path.join(story_dir, "persona_*.md")))
+        }
+        embeddings_file = os.path.join(story_dir, "embeddings.pkl")
+        sets_file = os.path.join(story_dir, "sets.json")
+        set_mapping = dict(SET_MAPPING)
+        if os.path.isfile(sets_file):
+            with open(sets_file, "r") as f:
+                set_mapping = {int(k): v for k, v in json.load(f).items()}
+        partitions.append(StoryPartition(
+            project=project,
+            story_id=os.path.basename(story_dir),
+            user_story_file=user_story_file,
+            persona_files=persona_files,
+            cq_file=cq_file,
+            embeddings_file=embeddings_file if os.path.isfile(embeddings_file) else None,
+            set_mapping=set_mapping,
+        ))
+    return partitions
+
+
+# -------------------------------------------------
+# --- Partition Tasks (run in worker processes) ---
+# -------------------------------------------------
+
+def _readability_task(cq_df: pd.DataFrame) -> pd.DataFrame:
+    from readability_measures import analyse_readability_batch
+    return pd.DataFrame(analyse_readability_batch(cq_df["cq"].tolist()), index=cq_df.index)
+
+
+def _complexity_task(cq_df: pd.DataFrame) -> pd.DataFrame:
+    from complexity import analyse_complexity_batch, NLP
+    results = pd.DataFrame(analyse_complexity_batch(cq_df["cq"].tolist(), NLP), index=cq_df.index)
+    results.insert(0, "c0_length", cq_df["cq"].str.len())
+    return results.drop(columns=["c3_relevant_dep_counts"], errors="ignore")
+
+
+def _embedding_task(partition: StoryPartition, n_clusters: int) -> pd.DataFrame:
+    from embedding import get_set_data, calculate_internal_diversity, calculate_shannon_entropy_for_set
+    embeddings_df = partition.load_embeddings()
+    embed_dim = len(embeddings_df["embedding"].iloc[0])
+    records = []
+    for set_name in embeddings_df["set"].unique():
+        _, embeddings = get_set_data(embeddings_df, set_name, embed_dim=embed_dim)
+        if embeddings.size == 0:
+            continue
+        record = {"set_name": set_name, **calculate_internal_diversity(embeddings, set_name)}
+        record["shannon_entropy"] = calculate_shannon_entropy_for_set(embeddings, set_name, n_clusters)
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def _coverage_task(partition: StoryPartition, threshold: float) -> pd.DataFrame:
+    from embedding import compute_pairwise_max_similarities
+    embeddings_df = partition.load_embeddings()
+    embed_dim = len(embeddings_df["embedding"].iloc[0])
+    max_similarities = compute_pairwise_max_similarities(
+        embeddings_df, list(embeddings_df["set"].unique()), embed_dim=embed_dim)
+    records = []
+    for (covered, covering), max_sims in max_similarities.items():
+        records.append({
+            "covered": covered,
+            "covering": covering,
+            "mean_max_similarity": np.mean(max_sims),
+            "percentage_covered": np.mean(max_sims >= threshold) * 100,
+            "percentage_novel": np.mean(max_sims < threshold) * 100,
+        })
+    return pd.DataFrame(records)
+
+
+def run_partition_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs one analysis on one partition (or on a chunk of its CQs). Output
+    printed by the analysis functions is captured rather than interleaved
+    across workers. Anything the analysis raises, including the `SystemExit`
+    of `complexity` when its spaCy model is missing, is raised as an
+    Exception so that the task is reported as failed.
+    """
+    partition = StoryPartition(**task["partition"])
+    analysis = task["analysis"]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if analysis in PER_CQ_ANALYSES:
+                cq_df = pd.DataFrame({"cq": task["cqs"]},
+                                     index=pd.RangeIndex(task["start"], task["stop"]))
+                result = _readability_task(cq_df) if analysis == "readability" \
+                    else _complexity_task(cq_df)
+            elif analysis == "embedding":
+                result = _embedding_task(partition, task["n_clusters"])
+            elif analysis == "coverage":
+                result = _coverage_task(partition, task["threshold"])
+            else:
+                raise ValueError(f"Unknown analysis '{analysis}'")
+    except Exception:
+        raise
+    except BaseException as e:
+        raise RuntimeError(f"Analysis '{analysis}' exited: {e!r}") from None
+    return {"project": partition.project, "story_id": partition.story_id,
+            "analysis": analysis, "result": result}
+
+
+# -------------------------------------------------
+# --- Scheduling ----------------------------------
+# -------------------------------------------------
+
+def make_partition_tasks(partitions: List[StoryPartition], analyses=ANALYSES,
+                         chunk_size: int = 256, threshold: float = 0.75,
+                         n_clusters: int = 5) -> List[Dict[str, Any]]:
+    """
+    Splits the work into tasks, sorted by estimated cost (largest first).
+    Per-CQ analyses are chunked by `chunk_size` CQs, and each chunk task
+    carries its CQs, so the CQ file of a partition is read only once;
+    embedding and coverage analyses need the embeddings of the partition
+    and are skipped otherwise.
+    """
+    tasks = []
+    for partition in partitions:
+        cqs = partition.load_cqs()["cq"].tolist()
+        num_cqs = len(cqs)
+        partition_dict = partition.model_dump()
+        for analysis in analyses:
+            if analysis in PER_CQ_ANALYSES:
+                for start in range(0, num_cqs, chunk_size):
+                    stop = min(start + chunk_size, num_cqs)
+                    tasks.append({"partition": partition_dict, "analysis": analysis,
+                                  "start": start, "stop": stop, "cqs": cqs[start:stop],
+                                  "cost": stop - start})
+            elif partition.embeddings_file:
+                # Coverage is quadratic in the number of CQs
+                cost = num_cqs if analysis == "embedding" else num_cqs ** 2 / chunk_size
+                tasks.append({"partition": partition_dict, "analysis": analysis,
+                              "threshold": threshold, "n_clusters": n_clusters, "cost": cost})
+    return sorted(tasks, key=lambda task: task["cost"], reverse=True)
+
+
+def run_partitions(partitions: List[StoryPartition], analyses=ANALYSES,
+                   max_workers: Optional[int] = None, chunk_size: int = 256,
+                   threshold: float = 0.75, n_clusters: int = 5,
+                   raise_on_error: bool = False) -> Dict[str, pd.DataFrame]:
+    """
+    Runs the analyses of all the partitions over a process pool and merges
+    the results (see `merge_partition_results`).
+
+    Tasks are kept in a queue sorted by cost and only a few per worker are
+    in flight at a time: whenever a worker finishes a task, the largest
+    remaining task is dispatched, so no worker idles while work is left.
+
+    Failed tasks are listed in the `errors` result (partition, analysis, CQ
+    range and error), as the aggregates then miss their data; with
+    `raise_on_error`, the first failure is raised instead.
+    """
+    tasks = deque(make_partition_tasks(partitions, analyses, chunk_size, threshold, n_clusters))
+    max_workers = max_workers or os.cpu_count() or 1
+    print(f"Scheduling {len(tasks)} tasks for {len(partitions)} partitions on {max_workers} workers")
+
+    outputs, errors = [], []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        while tasks or in_flight:
+            while tasks and len(in_flight) < 2 * max_workers:
+                task = tasks.popleft()
+                in_flight[executor.submit(run_partition_task, task)] = task
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = in_flight.pop(future)
+                try:
+                    outputs.append(future.result())
+                except Exception as e:
+                    if raise_on_error:
+                        for pending in in_flight:
+                            pending.cancel()
+                        raise
+                    partition = task["partition"]
+                    errors.append({"project": partition["project"], "story_id": partition["story_id"],
+                                   "analysis": task["analysis"], "start": task.get("start"),
+                                   "stop": task.get("stop"), "error": repr(e)})
+    if errors:
+        print(f"Warning: {len(errors)} of {len(errors) + len(outputs)} tasks failed; "
+              f"see the 'errors' result")
+    return merge_partition_results(outputs, partitions, errors)
+
+
+# -------------------------------------------------
+# --- Merging and Aggregation ---------------------
+# -------------------------------------------------
+
+def merge_partition_results(outputs: List[Dict[str, Any]], partitions: List[StoryPartition],
+                            errors: Optional[List[Dict[str, Any]]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Merges task outputs into indexed DataFrames:
+    - `cqs`: per-CQ measures, indexed by (project, story_id, cq_index).
+    - `diversity`: per-set diversity, indexed by (project, story_id, set_name).
+    - `coverage`: per-pair coverage, indexed by (project, story_id, covered, covering).
+    - `partition_summary`: mean per-CQ measures per partition and set.
+    - `global_summary`: mean per-CQ measures per set across all partitions,
+      plus an `ALL` row over every CQ.
+    - `errors`: the failed tasks, whose data is missing from the above.
+    """
+    by_analysis = {analysis: [] for analysis in ANALYSES}
+    per_cq_chunks = {}
+    for output in outputs:
+        result = output["result"]
+        if output["analysis"] in PER_CQ_ANALYSES:
+            key = (output["project"], output["story_id"], output["analysis"])
+            per_cq_chunks.setdefault(key, []).append(result)
+            continue
+        result = result.copy()
+        result.insert(0, "story_id", output["story_id"])
+        result.insert(0, "project", output["project"])
+        by_analysis[output["analysis"]].append(result)
+
+    # Per-CQ measures: join the chunks of every analysis onto the CQs
+    cq_frames = []
+    for partition in partitions:
+        cq_df = partition.load_cqs()[["cq", "set", "set_name"]]
+        cq_df.index.name = "cq_index"
+        for analysis in PER_CQ_ANALYSES:
+            chunks = per_cq_chunks.get((partition.project, partition.story_id, analysis))
+            if chunks:
+                cq_df = cq_df.join(pd.concat(chunks))
+        cq_df.insert(0, "story_id", partition.story_id)
+        cq_df.insert(0, "project", partition.project)
+        cq_frames.append(cq_df.reset_index())
+    cqs = pd.concat(cq_frames, ignore_index=True).set_index(PARTITION_INDEX + ["cq_index"]) \
+        if cq_frames else pd.DataFrame()
+
+    def concat_indexed(frames, index):
+        return pd.concat(frames, ignore_index=True).set_index(index) if frames else pd.DataFrame()
+
+    diversity = concat_indexed(by_analysis["embedding"], PARTITION_INDEX + ["set_name"])
+    coverage = concat_indexed(by_analysis["coverage"], PARTITION_INDEX + ["covered", "covering"])
+
+    measure_cols = [c for c in cqs.columns
+                    if c not in ("cq", "set", "set_name") and pd.api.types.is_numeric_dtype(cqs[c])]
+    partition_summary = cqs.groupby(PARTITION_INDEX + ["set_name"])[measure_cols].mean() \
+        if measure_cols else pd.DataFrame()
+    if measure_cols:
+        global_summary = cqs.groupby("set_name")[measure_cols].mean()
+        global_summary.loc["ALL"] = cqs[measure_cols].mean()
+        global_summary["num_cqs"] = cqs.groupby("set_name").size().reindex(global_summary.index)
+        global_summary.loc["ALL", "num_cqs"] = len(cqs)
+    else:
+        global_summary = pd.DataFrame()
+
+    return {"cqs": cqs, "diversity": diversity, "coverage": coverage,
+            "partition_summary": partition_summary, "global_summary": global_summary,
+            "errors": pd.DataFrame(errors or [], columns=ERROR_COLUMNS)}
+
+
+def save_partition_results(results: Dict[str, pd.DataFrame], output_dir: str):
+    """Saves each merged result as a CSV file in `output_dir`."""
+    os.makedirs(output_dir, exist_ok=True)
+    for name, result_df in results.items():
+        result_df.to_csv(os.path.join(output_dir, f"{name}.csv"))
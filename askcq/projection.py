@@ -0,0 +1,297 @@
+"""
+CQ Embedding Projection Module
+==============================
+This module projects large collections of CQ embeddings to 2D for plotting,
+where fitting a full `PCA` on an in-memory stack (as in
+`embedding.visualize_all_sets_pca`) is no longer viable. It includes:
+- A memory-mapped embedding store, filled and read in chunks.
+- Projection models fitted with randomized SVD (on a row sample) or with
+  IncrementalPCA (over all the chunks), persisted for reuse.
+- Density-aware downsampling and hexbin rendering, so that overviews with
+  millions of points render quickly on a headless (Agg) backend.
+"""
+import os
+import json
+import hashlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import joblib
+import matplotlib.pyplot as plt
+from sklearn.decomposition import PCA, IncrementalPCA
+
+
+# -------------------------------------------------
+# --- Memory-mapped Embedding Store ---------------
+# -------------------------------------------------
+
+class EmbeddingStore:
+    """
+    Embeddings stored as a float32 `.npy` memory map in `path`, with the set
+    label of each row in a sidecar `labels.npy` file and a `meta.json` file
+    with the shape of the store.
+    """
+    def __init__(self, path: str, mode: str = "r"):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode=mode)
+        self.labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r",
+                              allow_pickle=False)
+        self.set_names = self.meta["set_names"]
+
+    @classmethod
+    def create(cls, path: str, num_rows: int, embed_dim: int, set_names: List[str]):
+        """Creates an empty store, to be filled in chunks with `write`."""
+        os.makedirs(path, exist_ok=True)
+        np.lib.format.open_memmap(os.path.join(path, "embeddings.npy"), mode="w+",
+                                  dtype=np.float32, shape=(num_rows, embed_dim))
+        np.save(os.path.join(path, "labels.npy"), np.full(num_rows, -1, dtype=np.int16))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"num_rows": num_rows, "embed_dim": embed_dim,
+                       "set_names": list(set_names)}, f)
+        return cls(path, mode="r+")
+
+    @classmethod
+    def from_dataframe(cls, path: str, df: pd.DataFrame, set_mapping: Dict,
+                       embedding_col: str = 'embedding', set_col: str = 'set'):
+        """Creates a store from a DataFrame of embeddings (e.g. the SBERT pickle)."""
+        df = df[df[set_col].isin(list(set_mapping))]
+        embeddings = np.vstack(df[embedding_col].to_numpy()).astype(np.float32)
+        set_index = {set_id: i for i, set_id in enumerate(set_mapping)}
+        store = cls.create(path, embeddings.shape[0], embeddings.shape[1],
+                           [str(name) for name in set_mapping.values()])
+        store.write(0, embeddings, df[set_col].map(set_index).to_numpy())
+        return store
+
+    def write(self, start: int, embeddings: np.ndarray, labels: np.ndarray):
+        """Writes a chunk of embeddings and set labels (indices into `set_names`)."""
+        end = start + len(embeddings)
+        self.embeddings[start:end] = embeddings
+        all_labels = np.load(os.path.join(self.path, "labels.npy"), mmap_mode="r+")
+        all_labels[start:end] = labels
+        all_labels.flush()
+        self.embeddings.flush()
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def iter_chunks(self, chunk_size: int = 100_000) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yields (start row, float32 chunk) pairs over the whole store."""
+        return iter_chunks(self.embeddings, chunk_size)
+
+    def fingerprint(self) -> str:
+        """Cheap content hash (shape and a strided sample of rows) for caching."""
+        step = max(1, len(self) // 1000)
+        digest = hashlib.sha1(str(self.embeddings.shape).encode())
+        digest.update(np.ascontiguousarray(self.embeddings[::step]).tobytes())
+        return digest.hexdigest()[:16]
+
+
+# -------------------------------------------------
+# --- Projection Models ---------------------------
+# -------------------------------------------------
+
+def iter_chunks(embeddings: np.ndarray, chunk_size: int = 100_000) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yields (start row, float32 chunk) pairs over an array or memory map."""
+    for start in range(0, len(embeddings), chunk_size):
+        yield start, np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+
+
+def fit_projection(embeddings: np.ndarray, n_components: int = 2,
+                   method: str = "randomized", chunk_size: int = 100_000,
+                   max_fit_rows: int = 200_000, random_state: int = 42):
+    """
+    Fits a projection model on embeddings, which can be a memory map (e.g.
+    `EmbeddingStore.embeddings`) since rows are only read in chunks.
+
+    Args:
+        embeddings: The embeddings, one per row.
+        n_components: Number of components of the projection.
+        method: "randomized" fits a PCA with randomized SVD on a uniform
+            sample of at most `max_fit_rows` rows; "incremental" fits an
+            IncrementalPCA over all the rows, one chunk at a time.
+        chunk_size: Number of rows read from the store at a time.
+        max_fit_rows: Sample size for the randomized method.
+        random_state: Seed for sampling and the randomized SVD.
+
+    Returns:
+        The fitted sklearn model.
+    """
+    if method == "randomized":
+        rng = np.random.default_rng(random_state)
+        num_rows = len(embeddings)
+        if num_rows > max_fit_rows:
+            rows = np.sort(rng.choice(num_rows, size=max_fit_rows, replace=False))
+            sample = np.asarray(embeddings[rows], dtype=np.float32)
+        else:
+            sample = np.asarray(embeddings, dtype=np.float32)
+        model = PCA(n_components=n_components, svd_solver="randomized",
+                    random_state=random_state)
+        model.fit(sample)
+    elif method == "incremental":
+        model = IncrementalPCA(n_components=n_components)
+        for _, chunk in iter_chunks(embeddings, chunk_size):
+            if chunk.shape[0] >= n_components:  # partial_fit needs >= n_components rows
+                model.partial_fit(chunk)
+    else:
+        raise ValueError(f"Unknown projection method '{method}'")
+    return model
+
+
+def transform_embeddings(embeddings: np.ndarray, model, chunk_size: int = 100_000) -> np.ndarray:
+    """Projects embeddings (or a memory map of them), one chunk at a time."""
+    projected = np.empty((len(embeddings), model.n_components_), dtype=np.float32)
+    for start, chunk in iter_chunks(embeddings, chunk_size):
+        projected[start:start + len(chunk)] = model.transform(chunk)
+    return projected
+
+
+def load_or_fit_projection(store: EmbeddingStore, cache_dir: Optional[str] = None,
+                           n_components: int = 2, method: str = "randomized",
+                           chunk_size: int = 100_000, max_fit_rows: int = 200_000,
+                           random_state: int = 42):
+    """
+    Returns a persisted projection model for the store if there is one in
+    `cache_dir` (by default, the store directory), or fits and persists it.
+    Models are keyed by the store fingerprint and by every fitting parameter
+    (see `fit_projection`), so changing any of them fits a new model.
+    """
+    cache_dir = cache_dir or store.path
+    os.makedirs(cache_dir, exist_ok=True)
+    model_file = os.path.join(
+        cache_dir, f"projection_{method}_{n_components}d_chunk{chunk_size}_rows{max_fit_rows}"
+                   f"_seed{random_state}_{store.fingerprint()}.joblib")
+    if os.path.exists(model_file):
+        return joblib.load(model_file)
+    model = fit_projection(store.embeddings, n_components=n_components, method=method,
+                           chunk_size=chunk_size, max_fit_rows=max_fit_rows,
+                           random_state=random_state)
+    joblib.dump(model, model_file)
+    return model
+
+
+# -------------------------------------------------
+# --- Downsampling and Rendering ------------------
+# -------------------------------------------------
+
+def density_downsample(points: np.ndarray, labels: np.ndarray, max_points: int = 50_000,
+                       grid_size: int = 200, random_state: int = 42) -> np.ndarray:
+    """
+    Density-aware downsampling: points are binned on a `grid_size` x
+    `grid_size` grid and each (cell, label) keeps at most a fixed number of
+    points, so sparse regions and small sets survive while dense regions are
+    thinned. Returns the indices of the selected points.
+    """
+    num_points = len(points)
+    if num_points <= max_points:
+        return np.arange(num_points)
+
+    rng = np.random.default_rng(random_state)
+    mins, maxs = points.min(axis=0), points.max(axis=0)
+    spans = np.where(maxs > mins, maxs - mins, 1.0)
+    cells = np.minimum(((points - mins) / spans * grid_size).astype(np.int64), grid_size - 1)
+    keys = (cells[:, 0] * grid_size + cells[:, 1]) * (int(labels.max()) + 1) + labels
+
+    # Random order, then rank of each point within its (cell, label) group
+    order = rng.permutation(num_points)
+    sorted_keys = keys[order]
+    sort_idx = np.argsort(sorted_keys, kind="stable")
+    grouped_keys = sorted_keys[sort_idx]
+    group_starts = np.r_[0, np.flatnonzero(np.diff(grouped_keys)) + 1]
+    group_sizes = np.diff(np.r_[group_starts, num_points])
+    ranks = np.arange(num_points) - np.repeat(group_starts, group_sizes)
+
+    # Largest per-group cap that keeps the total within max_points
+    low, high = 1, int(group_sizes.max())
+    while low < high:
+        mid = (low + high + 1) // 2
+        if np.minimum(group_sizes, mid).sum() <= max_points:
+            low = mid
+        else:
+            high = mid - 1
+    cap = low
+    return np.sort(order[sort_idx[ranks < cap]])
+
+
+def plot_projection(points: np.ndarray, labels: np.ndarray, set_names: List[str],
+                    render: str = "hexbin", max_points: int = 50_000,
+                    gridsize: int = 150, explained_variance: Optional[np.ndarray] = None,
+                    output_file: Optional[str] = None, title: str = 'CQ Embeddings for All Sets (PCA)'):
+    """
+    Plots 2D projected embeddings coloured by set.
+
+    Args:
+        render: "hexbin" draws one log-scaled hexbin density panel per set;
+            "scatter" draws a single scatter plot of a density-aware sample
+            of at most `max_points` points.
+        output_file: If given, the figure is saved there and closed instead
+            of being shown (e.g. when running on the Agg backend).
+    """
+    def axis_label(i):
+        if explained_variance is None:
+            return f'Principal Component {i + 1}'
+        return f'Principal Component {i + 1} ({explained_variance[i]:.2%} variance)'
+
+    present = [i for i in range(len(set_names)) if np.any(labels == i)]
+    if render == "hexbin":
+        extent = (points[:, 0].min(), points[:, 0].max(), points[:, 1].min(), points[:, 1].max())
+        ncols = min(3, len(present))
+        nrows = int(np.ceil(len(present) / ncols))
+        fig, axes = plt.subplots(nrows, ncols, figsize=(6 * ncols, 5 * nrows),
+                                 squeeze=False, sharex=True, sharey=True)
+        for ax, i in zip(axes.flat, present):
+            set_points = points[labels == i]
+            hb = ax.hexbin(set_points[:, 0], set_points[:, 1], gridsize=gridsize,
+                           extent=extent, bins="log", mincnt=1, cmap="viridis")
+            fig.colorbar(hb, ax=ax, label="log10(count)")
+            ax.set_title(f'{set_names[i]} ({len(set_points):,} CQs)')
+            ax.set_xlabel(axis_label(0))
+            ax.set_ylabel(axis_label(1))
+        for ax in list(axes.flat)[len(present):]:
+            ax.set_visible(False)
+        fig.suptitle(title)
+    elif render == "scatter":
+        selected = density_downsample(points, labels, max_points=max_points)
+        fig, ax = plt.subplots(figsize=(12, 9))
+        for i in present:
+            mask = labels[selected] == i
+            ax.scatter(points[selected][mask, 0], points[selected][mask, 1],
+                       s=4 if len(selected) > 5000 else 50, alpha=0.7,
+                       label=set_names[i], rasterized=True, linewidths=0)
+        ax.set_title(title + (f' — {len(selected):,} of {len(points):,} points'
+                              if len(selected) < len(points) else ''))
+        ax.set_xlabel(axis_label(0))
+        ax.set_ylabel(axis_label(1))
+        ax.legend(title='Set Methodology', markerscale=3)
+        ax.grid(True, linestyle='--', alpha=0.5)
+    else:
+        raise ValueError(f"Unknown render mode '{render}'")
+
+    fig.tight_layout()
+    if output_file:
+        fig.savefig(output_file)
+        plt.close(fig)
+    else:
+        plt.show()
+    return fig
+
+
+def project_and_plot(store: EmbeddingStore, method: str = "randomized",
+                     render: str = "hexbin", cache_dir: Optional[str] = None,
+                     chunk_size: int = 100_000, output_file: Optional[str] = None, **plot_kwargs):
+    """
+    Projects a store to 2D with a (cached) projection model and plots it.
+    Returns the projected points.
+    """
+    model = load_or_fit_projection(store, cache_dir=cache_dir, n_components=2,
+                                   method=method, chunk_size=chunk_size)
+    points = transform_embeddings(store.embeddings, model, chunk_size=chunk_size)
+    labels = np.asarray(store.labels)
+    explained_var_ratio = model.explained_variance_ratio_
+    print(f"Explained variance by 2 components: {np.sum(explained_var_ratio):.4f}")
+    plot_projection(points, labels, store.set_names, render=render,
+                    explained_variance=explained_var_ratio,
+                    output_file=output_file, **plot_kwargs)
+    return points
@@ -1,6 +1,8 @@
 
 SYSTEM_ROLE_GEN = "You are an ontology engineer who is tasked to formulate requirements in the form of competency question given a set of persona descriptions and user stories."
 
+INSTRUCTION_GEN = "Generate competency questions based on the provided persona descriptions and user story."
+
 SYSTEM_ROLE_COMP = " You are an expert ontology engineer analyzing competency questions (CQs) to identify the underlying ontological primitives required to answer them. Your task is to analyze the given CQ and extract the relevant concepts, properties, relationships, filters, cardinality hints, and aggregation hints. You will also provide a brief explanation of your reasoning for each extracted element."
 
 SYSTEM_ROLE_RELEVANCE_A = "You are an expert ontology engineer analyzing competency questions (CQs) to identify their relevance to user stories. Your task is to evaluate the relevance of the given CQ with respect to the provided user story. You will measure relevance as a score from 1 to 4 based on the definitions provided and include a brief explanation of your reasoning."
@@ -84,4 +86,76 @@ Rate the relevance of the given competency question with respect to the given us
 **Instructions:**
 1.  **Rate Relevance:** Assign a score from 1 to 4 based on the definitions above.
 2.  **Provide Rationale:** Briefly explain your reasoning.
-"""
\ No newline at end of file
+"""
+
+
+# Batched variants of the relevance prompts: the (long) user story and persona
+# context come first and are shared by all the CQs in the batch, which are
+# listed with their identifiers so that each rating can be matched back.
+
+PROMPT_RELEVANCE_A_BATCH = """
+**User Story:**
+"{user_story}"
+
+
+Rate the relevance of each of the competency questions below with respect to the given user story using a Likert scale from 1 to 4, where:
+1 = The competency question introduces an extra requirement that is not expressed in the user story and cannot be inferred at all (non-necessary requirement);
+2 = The competency question cannot be inferred from the user story (even using common sense or domain knowledge) but is still an enabler for the requirements expressed in the user story;
+3 = The competency question addresses a requirement that can be inferred from the user story using common sense and domain knowledge;
+4 = The competency question addresses a requirement that is explicitly expressed in the user story.
+
+**Competency Questions:**
+{cqs}
+
+
+**Instructions:**
+1.  **Rate Relevance:** Assign a score from 1 to 4 to each competency question independently, based on the definitions above.
+2.  **Provide Rationale:** Briefly explain your reasoning for each competency question.
+3.  **Identify:** Return exactly one rating per competency question, using the identifier given in square brackets as `cq_id`.
+"""
+
+PROMPT_RELEVANCE_B_BATCH = """
+**User Story:**
+"{user_story}"
+
+
+As an ontology engineer, it is important that only competency questions entailing requirements that are explicitly expressed in the user story or functionally necessary to fulfill the user story are considered as relevant competency questions. Therefore, rate the relevance of each of the competency questions below with respect to the given user story using a Likert scale from 1 to 4, where:
+1 = The competency question introduces an extra requirement that is not expressed in the user story and cannot be inferred at all (non-necessary requirement);
+2 = The competency question cannot be inferred from the user story (even using domain knowledge) but the competency question is somewhat relevant to the persona for this user story;
+3 = The competency question addresses a requirement that can be inferred from the user story using domain knowledge and it still functionally necessary to fulfill the user story;
+4 = The competency question addresses a requirement that is explicitly expressed in the user story in its entirety.
+
+**Competency Questions:**
+{cqs}
+
+
+**Instructions:**
+1.  **Rate Relevance:** Assign a score from 1 to 4 to each competency question independently, based on the definitions above.
+2.  **Provide Rationale:** Briefly explain your reasoning for each competency question.
+3.  **Identify:** Return exactly one rating per competency question, using the identifier given in square brackets as `cq_id`.
+"""
+
+PROMPT_RELEVANCE_C_BATCH = """
+**Persona(s) Description:**
+"{persona_description}"
+
+
+**User Story:**
+"{user_story}"
+
+
+Rate the relevance of each of the competency questions below with respect to the given user story using a Likert scale from 1 to 4, where:
+1 = The competency question introduces an extra requirement that is not expressed in the user story and cannot be inferred at all (non-necessary requirement);
+2 = The competency question cannot be inferred from the user story (even using common sense or domain knowledge) but the competency question is somewhat relevant to the persona for this user story;
+3 = The competency question addresses a requirement that can be inferred from the user story using common sense and domain knowledge;
+4 = The competency question addresses a requirement that is explicitly expressed in the user story.
+
+**Competency Questions:**
+{cqs}
+
+
+**Instructions:**
+1.  **Rate Relevance:** Assign a score from 1 to 4 to each competency question independently, based on the definitions above.
+2.  **Provide Rationale:** Briefly explain your reasoning for each competency question.
+3.  **Identify:** Return exactly one rating per competency question, using the identifier given in square brackets as `cq_id`.
+"""
@@ -0,0 +1,36 @@
+"""
+CQ Readability Analysis Module
+==============================
+This module computes the readability indices used in the analysis of
+competency questions (CQs), as in `cq_readability.ipynb`. All the indices are
+computed with `textstat`, and higher values mean more difficult text.
+"""
+from typing import Dict, List
+
+import textstat
+
+# Readability columns, in the order returned by `compute_focused_readability`
+READABILITY_COLUMNS = ["read_fkgl", "read_gfi", "read_cli", "read_ari", "read_dcr"]
+
+acronyms_to_names = {
+    "read_fkgl": "Flesch-Kincaid Grade Level",
+    "read_gfi": "Gunning Fog Index",
+    "read_cli": "Coleman-Liau Index",
+    "read_dcr": "Dale-Chall Readability Score",
+    "read_ari": "Automated Readability Index",
+}
+
+
+def compute_focused_readability(cq):
+    """Computes the focused set of readability indices for a CQ."""
+    fkgl = textstat.flesch_kincaid_grade(cq)  # higher means more difficult
+    gfi = textstat.gunning_fog(cq)  # higher means more difficult
+    cli = textstat.coleman_liau_index(cq)  # higher means more difficult
+    ari = textstat.automated_readability_index(cq)  # higher means more difficult
+    dcr = textstat.dale_chall_readability_score(cq)  # higher means more difficult
+    return fkgl, gfi, cli, ari, dcr
+
+
+def analyse_readability_batch(cqs: List[str]) -> List[Dict[str, float]]:
+    """Readability indices of many CQs, keyed by their column names."""
+    return [dict(zip(READABILITY_COLUMNS, compute_focused_readability(cq))) for cq in cqs]
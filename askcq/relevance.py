@@ -0,0 +1,364 @@
+"""
+CQ Relevance Analysis Module
+============================
+This module rates the relevance of competency questions (CQs) with respect to
+a user story (and, optionally, persona descriptions) using an LLM. Besides the
+single-CQ mode used in the original experiments, it provides a batched mode
+that scores several CQs per request, so that the user story and persona
+context is sent (and billed) once per batch rather than once per CQ.
+
+Batches are sized adaptively under a token budget; batched responses are
+validated item by item, and only the CQs missing from a response (or with an
+invalid rating) are retried, in smaller batches.
+"""
+import time
+import json
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field, ValidationError
+from sklearn.metrics import cohen_kappa_score, confusion_matrix
+
+from config import LLM_CONFIG
+from prompts import SYSTEM_ROLE_RELEVANCE_A, PROMPT_RELEVANCE_A, \
+    PROMPT_RELEVANCE_A_BATCH, PROMPT_RELEVANCE_B, PROMPT_RELEVANCE_B_BATCH, \
+    PROMPT_RELEVANCE_C, PROMPT_RELEVANCE_C_BATCH
+
+# Batched counterpart of each single-CQ relevance prompt
+BATCH_PROMPTS = {
+    PROMPT_RELEVANCE_A: PROMPT_RELEVANCE_A_BATCH,
+    PROMPT_RELEVANCE_B: PROMPT_RELEVANCE_B_BATCH,
+    PROMPT_RELEVANCE_C: PROMPT_RELEVANCE_C_BATCH,
+}
+
+
+# -------------------------------------------------
+# --- Relevance Rating Models ---------------------
+# -------------------------------------------------
+
+class CQRelevanceRating(BaseModel):
+    score: Literal["1", "2", "3", "4"] = Field(
+        description="The relevance rating score from 1 to 4."
+    )
+    rationale: str = Field(
+        description="A brief explanation of the reasoning behind the score."
+    )
+
+    def to_dict(self):
+        return {
+            "score": self.score,
+            "rationale": self.rationale
+        }
+    def __str__(self):
+        return f"Score: {self.score}, Rationale: {self.rationale}"
+
+
+class CQBatchRelevanceRating(CQRelevanceRating):
+    """A relevance rating in a batch, keyed by the identifier of its CQ."""
+    cq_id: str = Field(
+        description="The identifier of the rated competency question, as given in square brackets."
+    )
+
+
+class CQRelevanceBatch(BaseModel):
+    """The list of relevance ratings returned for a batch of CQs."""
+    ratings: List[CQBatchRelevanceRating] = Field(
+        description="One relevance rating for each competency question in the batch.",
+        default_factory=list
+    )
+
+
+# -------------------------------------------------
+# --- LLM Backends --------------------------------
+# -------------------------------------------------
+
+def gemini_generate_fn(client, model: str = "gemini-2.5-pro-preview-03-25") -> Callable:
+    """
+    Creates a function prompting a Gemini model for structured output, with
+    signature `generate_fn(prompt, system_role, response_schema)`.
+    """
+    from google.genai import types
+
+    def generate_fn(prompt: str, system_role: str, response_schema):
+        response = client.models.generate_content(
+            model=model,
+            config=types.GenerateContentConfig(
+                response_mime_type='application/json',
+                response_schema=response_schema,
+                system_instruction=system_role,
+                temperature=LLM_CONFIG["temperature"],
+                top_p=LLM_CONFIG["top_p"],
+                frequency_penalty=LLM_CONFIG["frequency_penalty"],
+                presence_penalty=LLM_CONFIG["presence_penalty"],
+                seed=LLM_CONFIG["seed"],
+            ),
+            contents=prompt,
+        )
+        return response.parsed if response.parsed is not None else response.text
+
+    return generate_fn
+
+
+# -------------------------------------------------
+# --- Single-CQ Relevance -------------------------
+# -------------------------------------------------
+
+def relevance_analysis(generate_fn: Callable,
+                       cq: str,
+                       user_story: str,
+                       persona_descriptions: Optional[dict] = None,
+                       system_role: Optional[str] = SYSTEM_ROLE_RELEVANCE_A,
+                       prompt_template: Optional[str] = PROMPT_RELEVANCE_A) -> dict:
+    """
+    Analyzes the relevance of a single CQ with respect to a user story.
+
+    Args:
+        generate_fn: The LLM backend (see `gemini_generate_fn`).
+        cq (str): The CQ to be analyzed.
+        user_story (str): The user story, in markdown format.
+        persona_descriptions (dict): A dictionary containing persona
+            descriptions indexed by persona name and described in markdown.
+
+    Returns:
+        dict: A dictionary containing the relevance rating and rationale.
+    """
+    full_persona_description = "\n".join((persona_descriptions or {}).values())
+    prompt = prompt_template.format(
+        user_story=user_story,
+        persona_description=full_persona_description,
+        cq=cq,
+    )
+    response = generate_fn(prompt, system_role, CQRelevanceRating)
+    if not isinstance(response, CQRelevanceRating):
+        response = CQRelevanceRating.model_validate_json(response)
+    return response.to_dict()
+
+
+# -------------------------------------------------
+# --- Batched Relevance ---------------------------
+# -------------------------------------------------
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def format_cq_block(cq_items: List[Tuple[str, str]]) -> str:
+    """Formats (cq_id, cq) pairs as the CQ list of a batched prompt."""
+    return "\n".join(f'[{cq_id}] "{cq}"' for cq_id, cq in cq_items)
+
+
+def make_relevance_batches(cq_items: List[Tuple[str, str]],
+                           context_tokens: int,
+                           token_budget: int = 16000,
+                           max_batch_size: int = 25,
+                           output_tokens_per_cq: int = 200) -> List[List[Tuple[str, str]]]:
+    """
+    Greedily splits (cq_id, cq) pairs into batches so that the estimated
+    prompt and response tokens of each batch stay within `token_budget`,
+    with at most `max_batch_size` CQs per batch (and at least one).
+    """
+    batches, batch, batch_tokens = [], [], context_tokens
+    for cq_id, cq in cq_items:
+        item_tokens = estimate_tokens(f'[{cq_id}] "{cq}"') + output_tokens_per_cq
+        if batch and (len(batch) >= max_batch_size or
+                      batch_tokens + item_tokens > token_budget):
+            batches.append(batch)
+            batch, batch_tokens = [], context_tokens
+        batch.append((cq_id, cq))
+        batch_tokens += item_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_batch_response(response: Union[CQRelevanceBatch, str, dict, list],
+                         expected_ids: List[str]) -> Tuple[Dict[str, dict], List[str]]:
+    """
+    Validates a batched response item by item.
+
+    Ratings for unknown identifiers are discarded, duplicates keep the first
+    valid rating, and invalid items are dropped rather than failing the batch.
+
+    Returns:
+        A tuple with (ratings indexed by cq_id, ids that are still missing).
+    """
+    if isinstance(response, CQRelevanceBatch):
+        raw_items = [rating.model_dump() for rating in response.ratings]
+    else:
+        try:
+            data = json.loads(response) if isinstance(response, str) else response
+        except json.JSONDecodeError:
+            data = []
+        raw_items = data.get("ratings", []) if isinstance(data, dict) else data
+        if not isinstance(raw_items, list):
+            raw_items = []
+
+    expected = set(expected_ids)
+    ratings = {}
+    for item in raw_items:
+        if isinstance(item, dict) and isinstance(item.get("score"), int):
+            item = {**item, "score": str(item["score"])}
+        try:
+            rating = CQBatchRelevanceRating.model_validate(item)
+        except ValidationError:
+            continue
+        cq_id = rating.cq_id.strip().strip("[]")
+        if cq_id in expected and cq_id not in ratings:
+            ratings[cq_id] = rating.to_dict()
+
+    missing = [cq_id for cq_id in expected_ids if cq_id not in ratings]
+    return ratings, missing
+
+
+def batch_relevance_analysis(generate_fn: Callable,
+                             cqs: Union[Dict[Any, str], List[str]],
+                             user_story: str,
+                             persona_descriptions: Optional[dict] = None,
+                             system_role: Optional[str] = SYSTEM_ROLE_RELEVANCE_A,
+                             prompt_template: Optional[str] = PROMPT_RELEVANCE_A,
+                             token_budget: int = 16000,
+                             max_batch_size: int = 25,
+                             output_tokens_per_cq: int = 200,
+                             max_retries: int = 3,
+                             delay: float = .5) -> pd.DataFrame:
+    """
+    Analyzes the relevance of many CQs, scoring several CQs per request.
+
+    The batch size adapts to the token budget and is halved whenever a batch
+    comes back incomplete; only the missing CQs are retried, up to
+    `max_retries` times. CQs that cannot be rated are reported with a missing
+    score rather than raising an error.
+
+    Args:
+        generate_fn: The LLM backend (see `gemini_generate_fn`).
+        cqs: The CQs to rate, either as a list or as a dictionary indexed by
+            CQ identifier (e.g. the `id` column of the dataset).
+        user_story (str): The user story, in markdown format.
+        persona_descriptions (dict): Persona descriptions indexed by name.
+        system_role (str): The system role, as in the single-CQ mode.
+        prompt_template (str): A single-CQ relevance prompt (A, B, or C) or
+            its batched counterpart.
+        token_budget (int): Estimated prompt and response tokens per request.
+        max_batch_size (int): Maximum number of CQs per request.
+
+    Returns:
+        pd.DataFrame: One row per CQ with `cq_id`, `cq`, `relevance_score`
+            and `relevance_rationale`, in the order of the input.
+    """
+    if not isinstance(cqs, dict):
+        cqs = dict(enumerate(cqs))
+    cq_items = [(str(cq_id), cq) for cq_id, cq in cqs.items()]
+
+    batch_template = BATCH_PROMPTS.get(prompt_template, prompt_template)
+    full_persona_description = "\n".join((persona_descriptions or {}).values())
+    context = batch_template.format(user_story=user_story,
+                                    persona_description=full_persona_description,
+                                    cqs="")
+    context_tokens = estimate_tokens(system_role or "") + estimate_tokens(context)
+
+    ratings, num_requests = {}, 0
+    pending, batch_size = cq_items, max_batch_size
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        missing = []
+        batches = make_relevance_batches(pending, context_tokens, token_budget,
+                                         batch_size, output_tokens_per_cq)
+        for batch in batches:
+            prompt = batch_template.format(user_story=user_story,
+                                           persona_description=full_persona_description,
+                                           cqs=format_cq_block(batch))
+            try:
+                response = generate_fn(prompt, system_role, CQRelevanceBatch)
+                batch_ratings, batch_missing = parse_batch_response(
+                    response, [cq_id for cq_id, _ in batch])
+            except Exception as e:
+                print(f"Error processing batch of {len(batch)} CQs: {e}")
+                batch_ratings, batch_missing = {}, [cq_id for cq_id, _ in batch]
+            ratings.update(batch_ratings)
+            missing.extend(batch_missing)
+            num_requests += 1
+            time.sleep(delay)  # add a delay to avoid rate limits
+
+        missing = set(missing)
+        pending = [(cq_id, cq) for cq_id, cq in cq_items if cq_id in missing]
+        if pending and attempt < max_retries:
+            batch_size = max(1, min(batch_size, max(len(b) for b in batches)) // 2)
+            print(f"Attempt {attempt + 1}: {len(pending)} CQs missing, "
+                  f"retrying with batches of at most {batch_size} CQs")
+
+    print(f"Rated {len(ratings)}/{len(cq_items)} CQs with {num_requests} requests")
+    if pending:
+        print(f"Warning: {len(pending)} CQs could not be rated: {[i for i, _ in pending]}")
+
+    records = []
+    for (cq_id, cq), original_id in zip(cq_items, cqs.keys()):
+        rating = ratings.get(cq_id, {})
+        records.append({
+            "cq_id": original_id,
+            "cq": cq,
+            "relevance_score": int(rating["score"]) if rating else np.nan,
+            "relevance_rationale": rating.get("rationale"),
+        })
+    return pd.DataFrame(records)
+
+
+# -------------------------------------------------
+# --- Agreement with the Single-CQ Mode -----------
+# -------------------------------------------------
+
+def _cq_key(cq: str) -> str:
+    """Join key of a CQ: the text with collapsed and stripped whitespace."""
+    return " ".join(str(cq).split())
+
+
+def compare_relevance_modes(batch_df: pd.DataFrame,
+                            single_df: Union[pd.DataFrame, str] = "../data/bme_cq_relevance_ge25p_aa_score.csv",
+                            score_col: str = "relevance_score") -> dict:
+    """
+    Reports the agreement between batched and single-CQ relevance scores,
+    matching CQs by their text (with collapsed whitespace). Repeated CQs are
+    counted once, keeping their first score.
+
+    Returns:
+        dict: Number of matched CQs, exact agreement, agreement within one
+            point, quadratic-weighted Cohen's kappa, Spearman correlation,
+            mean score difference (batch - single), and the confusion matrix
+            (rows: single-CQ scores, columns: batched scores).
+    """
+    if isinstance(single_df, str):
+        single_df = pd.read_csv(single_df)
+    single_scores, batch_scores = (
+        df[["cq", score_col]].assign(cq=df["cq"].map(_cq_key)).drop_duplicates("cq")
+        for df in (single_df, batch_df))
+    merged = single_scores.merge(batch_scores, on="cq", suffixes=("_single", "_batch"))
+    merged = merged.dropna(subset=[f"{score_col}_single", f"{score_col}_batch"])
+
+    single = merged[f"{score_col}_single"].astype(int).to_numpy()
+    batch = merged[f"{score_col}_batch"].astype(int).to_numpy()
+    labels = [1, 2, 3, 4]
+
+    results = {"num_cqs": len(merged)}
+    if len(merged) == 0:
+        print("No CQs in common between batched and single-CQ scores.")
+        return results
+
+    results["exact_agreement"] = np.mean(single == batch)
+    results["within_one_agreement"] = np.mean(np.abs(single - batch) <= 1)
+    results["cohen_kappa_quadratic"] = cohen_kappa_score(single, batch, labels=labels,
+                                                         weights="quadratic")
+    results["spearman"] = pd.Series(single).corr(pd.Series(batch), method="spearman")
+    results["mean_difference"] = np.mean(batch - single)
+    results["confusion_matrix"] = pd.DataFrame(
+        confusion_matrix(single, batch, labels=labels),
+        index=[f"single_{l}" for l in labels], columns=[f"batch_{l}" for l in labels])
+
+    print(f"\n--- Batched vs Single-CQ Relevance ({results['num_cqs']} CQs) ---")
+    print(f"  Exact Agreement: {results['exact_agreement']:.2%}")
+    print(f"  Agreement within 1 point: {results['within_one_agreement']:.2%}")
+    print(f"  Cohen's Kappa (quadratic): {results['cohen_kappa_quadratic']:.4f}")
+    print(f"  Spearman Correlation: {results['spearman']:.4f}")
+    print(f"  Mean Score Difference (batch - single): {results['mean_difference']:+.3f}")
+    return results
@@ -0,0 +1,470 @@
+"""
+CQ Scoring Service
+==================
+A long-lived local HTTP service that keeps the analysis models warm (spaCy
+for complexity, SentenceTransformer for embeddings) so that authoring tools
+can score a CQ while it is being typed. Concurrent requests are coalesced
+into micro-batches (`nlp.pipe`, batched `encode`).
+
+Run it from the `askcq` folder with:
+
+    python serve.py --port 8765
+
+Endpoints (JSON in, JSON out; CQs are given as `{"cqs": [...]}` or `{"cq": "..."}`):
+- POST /complexity: linguistic (c2) and syntactic (c3) complexity.
+- POST /readability: readability indices (as in `cq_readability.ipynb`).
+- POST /novelty: max similarity of each CQ to every reference set, and
+  whether it is novel with respect to all of them at the threshold τ.
+- POST /relevance: cached relevance score and rationale, if available.
+- POST /score: all of the above (or a subset given as `"measures"`).
+- GET /metrics: request counts and p50/p99 latencies per endpoint.
+- GET /health: model versions and load time.
+- POST /reload: reloads models and reference data in the background and
+  swaps them in once ready (also triggered by SIGHUP).
+"""
+import sys
+import json
+import time
+import queue
+import pickle
+import signal
+import argparse
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from readability_measures import analyse_readability_batch
+
+DEFAULT_CONFIG = {
+    "spacy_model": "en_core_web_sm",
+    "sbert_model": "all-MiniLM-L6-v2",
+    "onnx_model_dir": None,
+    "reference_embeddings": "../data/embeddings/cq_embeddings_sbert.pkl",
+    "relevance_cache": "../data/bme_cq_relevance_ge25p_aa_score.csv",
+    "novelty_threshold": 0.75,
+    "max_batch_size": 64,
+    "max_wait_ms": 5.0,
+    "request_timeout_s": 30.0,
+}
+
+MEASURES = ("complexity", "readability", "novelty", "relevance")
+
+
+# -------------------------------------------------
+# --- Warm Models ---------------------------------
+# -------------------------------------------------
+
+class ScoringModels:
+    """
+    The models and reference data used for scoring, loaded once. Components
+    that cannot be loaded (e.g. sentence-transformers is not installed) are
+    disabled with a warning rather than failing the whole service.
+    """
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.loaded_at = time.time()
+        self.nlp, self._analyse_complexity_batch = self._load_complexity(config["spacy_model"])
+        self.encoder = self._load_encoder(config["sbert_model"], config.get("onnx_model_dir"))
+        self.reference = self._load_reference(config["reference_embeddings"])
+        self.relevance_cache = self._load_relevance_cache(config["relevance_cache"])
+
+    @staticmethod
+    def _load_complexity(model_name):
+        """
+        Imports `complexity` at startup, as it loads its default spaCy model
+        at import time (and exits if it is missing), and reuses that model
+        when it is the configured one.
+        """
+        try:
+            import spacy
+            import complexity
+            if model_name == complexity.SPACY_MODEL_NAME:
+                return complexity.NLP, complexity.analyse_complexity_batch
+            return spacy.load(model_name), complexity.analyse_complexity_batch
+        except (ImportError, OSError, SystemExit) as e:
+            print(f"Warning: spaCy model '{model_name}' not available ({e!r}). Complexity disabled.")
+            return None, None
+
+    @staticmethod
+    def _load_encoder(model_name, onnx_model_dir=None):
+        if onnx_model_dir:
+            try:
+                from onnx_embedding import OnnxSentenceEncoder
+                return OnnxSentenceEncoder(onnx_model_dir)
+            except Exception as e:
+                print(f"Warning: ONNX encoder in '{onnx_model_dir}' not available ({e}). "
+                      f"Falling back to SentenceTransformer.")
+        try:
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(model_name, device="cpu")
+        except Exception as e:
+            print(f"Warning: SentenceTransformer '{model_name}' not available ({e}). Novelty disabled.")
+            return None
+
+    @staticmethod
+    def _load_reference(reference_file):
+        """Reference embeddings per set, L2-normalised once for dot products."""
+        try:
+            with open(reference_file, "rb") as f:
+                reference_df = pd.DataFrame(pickle.load(f))
+        except (OSError, pickle.UnpicklingError) as e:
+            print(f"Warning: Could not load reference embeddings ({e}). Novelty disabled.")
+            return {}
+        reference = {}
+        for set_name, set_df in reference_df.groupby("set", sort=False):
+            embeddings = np.vstack(set_df["embedding"].to_numpy()).astype(np.float32)
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            reference[set_name] = (set_df["cq"].tolist(), embeddings)
+        return reference
+
+    @staticmethod
+    def _load_relevance_cache(relevance_file):
+        try:
+            relevance_df = pd.read_csv(relevance_file)
+        except OSError as e:
+            print(f"Warning: Could not load relevance cache ({e}).")
+            return {}
+        return {normalise_cq(row["cq"]): {"relevance_score": int(row["relevance_score"]),
+                                          "relevance_rationale": row["relevance_rationale"]}
+                for _, row in relevance_df.iterrows()}
+
+    # --- Batched scoring functions (one call per micro-batch) ---
+
+    def complexity(self, cqs: List[str]) -> List[Dict[str, Any]]:
+        if self.nlp is None:
+            raise RuntimeError("complexity is disabled: no spaCy model loaded")
+        return self._analyse_complexity_batch(cqs, self.nlp, batch_size=len(cqs))
+
+    def readability(self, cqs: List[str]) -> List[Dict[str, Any]]:
+        return analyse_readability_batch(cqs)
+
+    def novelty(self, cqs: List[str]) -> List[Dict[str, Any]]:
+        if self.encoder is None or not self.reference:
+            raise RuntimeError("novelty is disabled: no encoder or reference embeddings loaded")
+        embeddings = self.encoder.encode(cqs, batch_size=len(cqs), convert_to_numpy=True,
+                                         normalize_embeddings=True, device="cpu")
+        threshold = self.config["novelty_threshold"]
+        results = [{"max_similarity": {}, "most_similar_cq": {}} for _ in cqs]
+        for set_name, (set_cqs, set_embeddings) in self.reference.items():
+            similarities = embeddings @ set_embeddings.T
+            best = np.argmax(similarities, axis=1)
+            for i, j in enumerate(best):
+                results[i]["max_similarity"][set_name] = float(similarities[i, j])
+                results[i]["most_similar_cq"][set_name] = set_cqs[j]
+        for result in results:
+            result["novel"] = bool(max(result["max_similarity"].values()) < threshold)
+            result["threshold"] = threshold
+        return results
+
+    def relevance(self, cqs: List[str]) -> List[Dict[str, Any]]:
+        return [self.relevance_cache.get(normalise_cq(cq), {"relevance_score": None,
+                                                            "relevance_rationale": None})
+                for cq in cqs]
+
+
+def normalise_cq(cq: str) -> str:
+    """Key used for cache lookups: case- and whitespace-insensitive."""
+    return " ".join(str(cq).lower().split())
+
+
+# -------------------------------------------------
+# --- Micro-batching and Metrics ------------------
+# -------------------------------------------------
+
+class MicroBatcher:
+    """
+    Coalesces single items submitted concurrently into batches. A worker
+    thread waits for a first item, then collects more for up to
+    `max_wait_ms` (or until `max_batch_size` items), and calls
+    `batch_fn(items)`, which must return one result per item. If a batch
+    fails, its items are retried one by one, so that a single bad item only
+    fails its own request.
+    """
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes = deque(maxlen=10_000)
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            items, futures = zip(*batch)
+            self.batch_sizes.append(len(items))
+            try:
+                results = self._call(list(items))
+            except Exception as e:
+                if len(items) == 1:
+                    futures[0].set_exception(e)
+                    continue
+                # Retry one by one, so that a failing item only fails its own request
+                for item, future in zip(items, futures):
+                    try:
+                        future.set_result(self._call([item])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def _call(self, items: List[Any]) -> List[Any]:
+        """Calls `batch_fn`, turning anything it raises (even `SystemExit`) into an Exception."""
+        try:
+            results = self.batch_fn(items)
+        except Exception:
+            raise
+        except BaseException as e:
+            raise RuntimeError(f"Batch function exited: {e!r}") from e
+        if len(results) != len(items):
+            raise RuntimeError(f"Batch function returned {len(results)} results for {len(items)} items")
+        return results
+
+
+class LatencyTracker:
+    """Keeps the latest request latencies per endpoint for percentile metrics."""
+    def __init__(self, window: int = 10_000):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, error: bool = False):
+        with self._lock:
+            self._latencies[endpoint].append(seconds * 1000)
+            self._counts[endpoint] += 1
+            self._errors[endpoint] += int(error)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            summary = {}
+            for endpoint, latencies in self._latencies.items():
+                latencies = np.asarray(latencies)
+                summary[endpoint] = {
+                    "count": self._counts[endpoint],
+                    "errors": self._errors[endpoint],
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p99_ms": float(np.percentile(latencies, 99)),
+                    "mean_ms": float(np.mean(latencies)),
+                }
+            return summary
+
+
+# -------------------------------------------------
+# --- Service -------------------------------------
+# -------------------------------------------------
+
+class ScoringService:
+    """
+    Holds the current `ScoringModels` and one micro-batcher per measure.
+    Batchers always use the models current at batch time, so a reload swaps
+    models atomically without dropping in-flight requests.
+    """
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 models_factory: Callable[[Dict[str, Any]], Any] = ScoringModels):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.models_factory = models_factory
+        self.models = models_factory(self.config)
+        self.version = 1
+        self.metrics = LatencyTracker()
+        self._reload_lock = threading.Lock()
+        self.batchers = {
+            measure: MicroBatcher(lambda cqs, m=measure: getattr(self.models, m)(cqs),
+                                  self.config["max_batch_size"], self.config["max_wait_ms"])
+            for measure in MEASURES
+        }
+
+    def score(self, cqs: List[str], measures: List[str]) -> List[Dict[str, Any]]:
+        """Scores CQs, submitting each one individually to the batchers."""
+        if not isinstance(cqs, list) or not cqs or not all(isinstance(cq, str) for cq in cqs):
+            raise ValueError("Expected 'cqs' to be a non-empty list of strings")
+        if not isinstance(measures, list) or not all(isinstance(m, str) for m in measures):
+            raise ValueError(f"Expected 'measures' to be a list of strings, from {list(MEASURES)}")
+        unknown = set(measures) - set(MEASURES)
+        if unknown:
+            raise ValueError(f"Unknown measures: {sorted(unknown)}")
+        futures = {measure: [self.batchers[measure].submit(cq) for cq in cqs]
+                   for measure in measures}
+        results = [{"cq": cq} for cq in cqs]
+        for measure, measure_futures in futures.items():
+            for result, future in zip(results, measure_futures):
+                result[measure] = future.result(timeout=self.config["request_timeout_s"])
+        return results
+
+    def reload(self, blocking: bool = False) -> bool:
+        """Loads new models and swaps them in; False if a reload is in progress."""
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+
+        def _reload():
+            try:
+                started = time.time()
+                models = self.models_factory(self.config)
+                self.models = models
+                self.version += 1
+                print(f"Reloaded models (version {self.version}) in {time.time() - started:.1f}s")
+            except Exception as e:
+                print(f"Error reloading models, keeping the current ones: {e}")
+            finally:
+                self._reload_lock.release()
+
+        if blocking:
+            _reload()
+        else:
+            threading.Thread(target=_reload, daemon=True).start()
+        return True
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "version": self.version,
+            "loaded_at": self.models.loaded_at,
+            "reloading": self._reload_lock.locked(),
+        }
+
+    def metrics_summary(self) -> Dict[str, Any]:
+        batch_sizes = {measure: float(np.mean(batcher.batch_sizes)) if batcher.batch_sizes else 0.0
+                       for measure, batcher in self.batchers.items()}
+        return {"latency": self.metrics.summary(), "mean_batch_size": batch_sizes}
+
+
+def make_handler(service: ScoringService):
+    """Creates the HTTP request handler bound to a scoring service."""
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload: Any):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, endpoint: str, fn: Callable[[], Any]):
+            started, error = time.perf_counter(), False
+            try:
+                self._send(200, fn())
+            except ValueError as e:
+                error = True
+                self._send(400, {"error": str(e)})
+            except FutureTimeoutError:
+                error = True
+                self._send(504, {"error": "Timed out waiting for the scores"})
+            except Exception as e:
+                error = True
+                self._send(500, {"error": str(e)})
+            finally:
+                service.metrics.record(endpoint, time.perf_counter() - started, error)
+
+        def _read_cqs(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON: {e}")
+            if not isinstance(payload, dict):
+                raise ValueError("Expected a JSON object")
+            if "cqs" in payload:
+                cqs = payload["cqs"]
+                if not isinstance(cqs, list) or not cqs or not all(isinstance(cq, str) for cq in cqs):
+                    raise ValueError("Expected 'cqs' to be a non-empty list of strings")
+            elif isinstance(payload.get("cq"), str):
+                cqs = [payload["cq"]]
+            else:
+                raise ValueError("Expected a 'cq' string or a non-empty 'cqs' list of strings")
+            return cqs, payload
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._handle("health", service.health)
+            elif self.path == "/metrics":
+                self._send(200, service.metrics_summary())
+            else:
+                self._send(404, {"error": f"Unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            endpoint = self.path.strip("/")
+            if endpoint == "reload":
+                self._handle(endpoint, lambda: {"reloading": service.reload()})
+            elif endpoint in MEASURES:
+                def fn():
+                    cqs, _ = self._read_cqs()
+                    return [r[endpoint] for r in service.score(cqs, [endpoint])]
+                self._handle(endpoint, fn)
+            elif endpoint == "score":
+                def fn():
+                    cqs, payload = self._read_cqs()
+                    return service.score(cqs, payload.get("measures", list(MEASURES)))
+                self._handle(endpoint, fn)
+            else:
+                self._send(404, {"error": f"Unknown endpoint {self.path}"})
+
+        def log_message(self, format, *args):
+            pass  # latencies are tracked in /metrics instead
+
+    return ScoringHandler
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # many clients scoring while typing
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765,
+          config: Optional[Dict[str, Any]] = None,
+          service: Optional[ScoringService] = None) -> ScoringServer:
+    """
+    Creates the scoring server (bound to localhost by default). Call
+    `serve_forever()` on the result, or run it in a thread for tests.
+    """
+    service = service or ScoringService(config)
+    server = ScoringServer((host, port), make_handler(service))
+    server.service = service
+    return server
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Local CQ scoring service with warm models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    for key, value in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=str if value is None else type(value), default=value)
+    args = vars(parser.parse_args(argv))
+    host, port = args.pop("host"), args.pop("port")
+
+    server = serve(host, port, config=args)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda *_: server.service.reload())
+    print(f"Serving CQ scores on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
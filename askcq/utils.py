@@ -2,6 +2,9 @@
 Collects utility functions for the xaniml package.
 """
 
+import json
+import hashlib
+
 import yaml
 
 
@@ -18,3 +21,8 @@ def get_key(service, config_file="api_config.yml"):
 # Generate a hash from the LLM config
 def generate_hash(config):
     return hash(frozenset(config.items()))
+
+# Generate a hash from the LLM config that is the same in every process
+# (`generate_hash` depends on PYTHONHASHSEED), e.g. to join generation runs
+def generate_stable_hash(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
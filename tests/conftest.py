@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The askcq modules use flat imports, as when run from the askcq folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "askcq"))
@@ -0,0 +1,76 @@
+"""
+A local stub of the OpenAI chat completions endpoint, streaming scripted
+responses as server-sent events, to test CQ generation without an API key.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    """
+    Serves `POST /v1/chat/completions` with `stream=True`. `scripts` maps a
+    model name to its successive responses: each response is a dictionary
+    with the text `chunks` to stream and, optionally, `error_after` (number
+    of chunks after which an error event is sent instead of completing).
+    The last response of a model is repeated once the script is exhausted.
+    """
+    daemon_threads = True
+
+    def __init__(self, scripts: Dict[str, List[Dict[str, Any]]], host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), StubOpenAIHandler)
+        self.scripts = {model: list(responses) for model, responses in scripts.items()}
+        self.requests: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def next_response(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.requests.append(request)
+            responses = self.scripts[request["model"]]
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+
+    def _event(self, payload: Any):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        response = self.server.next_response(request)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        error_after = response.get("error_after")
+        for i, chunk in enumerate(response["chunks"]):
+            if error_after is not None and i == error_after:
+                break
+            self._event({
+                "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0,
+                "model": request["model"],
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+            })
+        if error_after is not None:
+            self._event({"error": {"message": "stub model overloaded", "type": "server_error"}})
+        else:
+            self._event("[DONE]")
+
+    def log_message(self, format, *args):
+        pass
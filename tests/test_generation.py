@@ -0,0 +1,110 @@
+"""Tests of the streamed CQ generation, against a local OpenAI-compatible stub."""
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("openai")
+
+from generation import DATASET_FIELDS, PROVENANCE_FIELDS, build_generation_grid, \
+    generate_cqs, openai_stream_fn
+from stub_openai_server import StubOpenAIServer
+from utils import generate_stable_hash
+
+# CQs split at arbitrary points, including inside the enumeration prefix
+SPLIT_CHUNKS = ["**CQ1:** What is the na", "me of an item?\n", "2", ". Who owns an it",
+                "em?\nSome commentary.\n3. When was the item ", "made?"]
+SPLIT_CQS = ["What is the name of an item?", "Who owns an item?", "When was the item made?"]
+
+
+def run_generation(scripts, tmp_path, models, seeds=None, max_workers=1, **kwargs):
+    output_file = tmp_path / "generated_cqs.csv"
+    with StubOpenAIServer(scripts) as server:
+        summaries = generate_cqs({"*": openai_stream_fn(base_url=server.base_url)}, "prompt",
+                                 build_generation_grid(models, seeds=seeds), str(output_file),
+                                 max_workers=max_workers, **kwargs)
+        requests = list(server.requests)
+    return pd.read_csv(output_file, dtype={"config_hash": str}), summaries, requests
+
+
+def test_cqs_split_across_chunks_are_parsed(tmp_path):
+    generated, summaries, _ = run_generation({"stub-a": [{"chunks": SPLIT_CHUNKS}]},
+                                             tmp_path, ["stub-a"])
+    assert generated["cq"].tolist() == SPLIT_CQS
+    assert summaries == [{"model": "stub-a", "seed": 46, "temperature": 0,
+                          "num_cqs": 3, "error": None}]
+
+
+def test_ids_follow_arrival_order(tmp_path):
+    scripts = {"stub-a": [{"chunks": SPLIT_CHUNKS}], "stub-b": [{"chunks": ["1. Is it loaned?\n"]}]}
+    generated, _, _ = run_generation(scripts, tmp_path, ["stub-a", "stub-b"], seeds=[1, 2],
+                                     max_workers=4, start_id=101)
+    assert generated["id"].tolist() == list(range(101, 101 + 8))
+    for _, run_df in generated.groupby(["model", "seed"]):
+        assert run_df["id"].is_monotonic_increasing
+        assert run_df["position"].tolist() == list(range(len(run_df)))
+
+
+def test_provenance_columns(tmp_path):
+    generated, _, requests = run_generation(
+        {"stub-a": [{"chunks": SPLIT_CHUNKS}]}, tmp_path, ["stub-a"], seeds=[7],
+        set_mapping={"stub-a": 4})
+    config = build_generation_grid(["stub-a"], seeds=[7])[0]["config"]
+
+    assert generated.columns.tolist() == DATASET_FIELDS + PROVENANCE_FIELDS
+    assert (generated["set"] == 4).all()
+    assert (generated["model"] == "stub-a").all()
+    assert (generated["seed"] == 7).all() and (generated["temperature"] == 0).all()
+    assert (generated["config_hash"] == generate_stable_hash(config)).all()
+    assert requests[0]["seed"] == 7 and requests[0]["stream"] is True
+
+
+def test_config_hash_is_stable_across_processes():
+    code = "from config import LLM_CONFIG; from utils import generate_stable_hash; " \
+           "print(generate_stable_hash(LLM_CONFIG))"
+    askcq_dir = os.path.dirname(sys.modules["generation"].__file__)
+    hashes = {subprocess.run([sys.executable, "-c", code], cwd=askcq_dir, capture_output=True, text=True,
+                             env={**os.environ, "PYTHONHASHSEED": seed}).stdout.strip()
+              for seed in ("1", "2")}
+    assert len(hashes) == 1 and "" not in hashes
+
+
+def test_run_is_retried_if_it_fails_before_the_first_cq(tmp_path):
+    scripts = {"stub-a": [{"chunks": ["1. What is the na", "me of an item?\n"], "error_after": 1},
+                          {"chunks": SPLIT_CHUNKS}]}
+    generated, summaries, requests = run_generation(scripts, tmp_path, ["stub-a"])
+    assert len(requests) == 2
+    assert generated["cq"].tolist() == SPLIT_CQS
+    assert summaries[0]["error"] is None and summaries[0]["num_cqs"] == 3
+
+
+def test_run_is_not_retried_after_partial_output(tmp_path):
+    scripts = {"stub-a": [{"chunks": SPLIT_CHUNKS, "error_after": 2}, {"chunks": SPLIT_CHUNKS}]}
+    generated, summaries, requests = run_generation(scripts, tmp_path, ["stub-a"])
+    assert len(requests) == 1
+    assert generated["cq"].tolist() == SPLIT_CQS[:1]
+    assert summaries[0]["num_cqs"] == 1 and "overloaded" in summaries[0]["error"]
+
+
+def test_run_fails_after_max_retries(tmp_path):
+    scripts = {"stub-a": [{"chunks": ["1. What"], "error_after": 0}]}
+    generated, summaries, requests = run_generation(scripts, tmp_path, ["stub-a"], max_retries=2)
+    assert len(requests) == 3
+    assert generated.empty
+    assert summaries[0]["num_cqs"] == 0 and summaries[0]["error"]
+
+
+def test_second_fan_out_appends_with_continuing_ids(tmp_path):
+    scripts = {"stub-a": [{"chunks": SPLIT_CHUNKS}], "stub-b": [{"chunks": ["1. Is it loaned?\n"]}]}
+    run_generation(scripts, tmp_path, ["stub-a"])
+    generated, _, _ = run_generation(scripts, tmp_path, ["stub-b"])
+    assert generated["id"].tolist() == [1, 2, 3, 4]
+    assert generated["model"].tolist() == ["stub-a"] * 3 + ["stub-b"]
+
+
+def test_appending_to_a_file_with_other_columns_fails(tmp_path):
+    (tmp_path / "generated_cqs.csv").write_text("id,cq,set\n1,What is an item?,1\n")
+    with pytest.raises(ValueError):
+        run_generation({"stub-a": [{"chunks": SPLIT_CHUNKS}]}, tmp_path, ["stub-a"])
@@ -0,0 +1,134 @@
+"""Tests of the batched relevance analysis, with a scripted LLM backend."""
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+from relevance import CQRelevanceBatch, batch_relevance_analysis, compare_relevance_modes, \
+    parse_batch_response
+
+CQS = {f"q{i}": f"What is item {i}?" for i in range(8)}
+
+
+def rating(cq_id, score=3, rationale="Inferred."):
+    return {"cq_id": cq_id, "score": score, "rationale": rationale}
+
+
+class ScriptedGenerateFn:
+    """
+    Answers each request with the next scripted reply: a function of the
+    requested CQ ids returning a response, or an exception to raise.
+    """
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requested_ids = []
+
+    def __call__(self, prompt, system_role, response_schema):
+        assert response_schema is CQRelevanceBatch
+        cq_ids = re.findall(r'^\[(\w+)\] "', prompt, flags=re.MULTILINE)
+        self.requested_ids.append(cq_ids)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply(cq_ids)
+
+
+def rate_all(cq_ids):
+    return json.dumps({"ratings": [rating(cq_id, score="4") for cq_id in cq_ids]})
+
+
+def run_batches(generate_fn, **kwargs):
+    return batch_relevance_analysis(generate_fn, CQS, "As a curator, I want to track items.",
+                                    delay=0, **kwargs)
+
+
+# --- parse_batch_response ---
+
+def test_parse_keeps_first_rating_of_expected_ids():
+    response = {"ratings": [rating("q0", 4), rating("[q1]", "2"), rating("q0", 1),
+                            rating("q9", 4), {"cq_id": "q2", "score": 7, "rationale": "?"}]}
+    ratings, missing = parse_batch_response(response, ["q0", "q1", "q2", "q3"])
+    assert ratings == {"q0": {"score": "4", "rationale": "Inferred."},
+                       "q1": {"score": "2", "rationale": "Inferred."}}
+    assert missing == ["q2", "q3"]
+
+
+def test_parse_accepts_json_lists_and_models():
+    ratings, missing = parse_batch_response(json.dumps([rating("q0", 1)]), ["q0"])
+    assert ratings["q0"]["score"] == "1" and missing == []
+
+    batch = CQRelevanceBatch.model_validate({"ratings": [rating("q0", "3")]})
+    ratings, missing = parse_batch_response(batch, ["q0", "q1"])
+    assert ratings["q0"]["score"] == "3" and missing == ["q1"]
+
+
+def test_parse_invalid_json_misses_every_id():
+    assert parse_batch_response("not json", ["q0", "q1"]) == ({}, ["q0", "q1"])
+    assert parse_batch_response({"ratings": "q0: 4"}, ["q0"]) == ({}, ["q0"])
+
+
+# --- batch_relevance_analysis ---
+
+def test_complete_batches_are_not_retried():
+    generate_fn = ScriptedGenerateFn(rate_all)
+    rated = run_batches(generate_fn, max_batch_size=4)
+    assert generate_fn.requested_ids == [list(CQS)[:4], list(CQS)[4:]]
+    assert rated["cq_id"].tolist() == list(CQS)
+    assert rated["cq"].tolist() == list(CQS.values())
+    assert (rated["relevance_score"] == 4).all()
+
+
+def test_only_missing_ids_are_retried_in_halved_batches():
+    def rate_all_but_odd(cq_ids):
+        return {"ratings": [rating(cq_id) for cq_id in cq_ids if int(cq_id[1:]) % 2 == 0]}
+
+    generate_fn = ScriptedGenerateFn(rate_all_but_odd, rate_all)
+    rated = run_batches(generate_fn, max_batch_size=8)
+    assert generate_fn.requested_ids == [list(CQS), ["q1", "q3", "q5", "q7"]]
+    assert rated["relevance_score"].tolist() == [3, 4] * 4
+
+
+def test_batch_size_is_halved_on_each_retry():
+    def rate_none(cq_ids):
+        return {"ratings": []}
+
+    generate_fn = ScriptedGenerateFn(rate_none, rate_none, rate_all)
+    run_batches(generate_fn, max_batch_size=8)
+    assert [len(ids) for ids in generate_fn.requested_ids] == [8, 4, 4, 2, 2]
+
+
+def test_raising_batch_is_retried():
+    generate_fn = ScriptedGenerateFn(rate_all, RuntimeError("quota exceeded"), rate_all)
+    rated = run_batches(generate_fn, max_batch_size=4)
+    assert generate_fn.requested_ids == [list(CQS)[:4], list(CQS)[4:], list(CQS)[4:6], list(CQS)[6:]]
+    assert rated["relevance_score"].notna().all()
+
+
+def test_unrated_cqs_are_reported_as_missing():
+    generate_fn = ScriptedGenerateFn(lambda cq_ids: rate_all([i for i in cq_ids if i != "q5"]))
+    rated = run_batches(generate_fn, max_batch_size=8, max_retries=2)
+    assert len(generate_fn.requested_ids) == 3
+    assert generate_fn.requested_ids[1:] == [["q5"], ["q5"]]
+    assert np.isnan(rated.set_index("cq_id").loc["q5", "relevance_score"])
+    assert rated["relevance_score"].notna().sum() == 7
+
+
+def test_list_input_is_indexed_by_position():
+    rated = batch_relevance_analysis(ScriptedGenerateFn(rate_all), ["What is an item?", "Who owns it?"],
+                                     "As a curator, I want to track items.", delay=0)
+    assert rated["cq_id"].tolist() == [0, 1]
+
+
+# --- compare_relevance_modes ---
+
+def test_compare_matches_normalised_text_once():
+    single = pd.DataFrame({"cq": ["What is an item?", "What is an item?", "Who  owns it?"],
+                           "relevance_score": [4, 4, 2]})
+    batch = pd.DataFrame({"cq": [" What is an item?", "Who owns it?\n", "Who owns it?"],
+                          "relevance_score": [4, 3, 3]})
+    results = compare_relevance_modes(batch, single)
+    assert results["num_cqs"] == 2
+    assert results["exact_agreement"] == 0.5
+    assert results["within_one_agreement"] == 1.0
+    assert results["confusion_matrix"].to_numpy().sum() == 2
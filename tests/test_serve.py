@@ -0,0 +1,131 @@
+"""Tests of the local scoring service, against a server on localhost."""
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from serve import MicroBatcher, ScoringService, serve
+
+
+class StubModels:
+    """Scoring models without spaCy or SBERT."""
+    def __init__(self, config):
+        self.loaded_at = time.time()
+
+    def complexity(self, cqs):
+        time.sleep(0.01)
+        return [{"c0_length": len(cq)} for cq in cqs]
+
+    def readability(self, cqs):
+        if "boom" in cqs:
+            raise RuntimeError("cannot score boom")
+        return [{"read_words": len(cq.split())} for cq in cqs]
+
+    def novelty(self, cqs):
+        return [{"novel": True} for _ in cqs]
+
+    def relevance(self, cqs):
+        return [{"relevance_score": None} for _ in cqs]
+
+
+@pytest.fixture
+def server():
+    service = ScoringService({"max_wait_ms": 20.0}, models_factory=StubModels)
+    server = serve(port=0, service=service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, path, payload=None):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_concurrent_requests_are_micro_batched(server):
+    cqs = [f"What is item {i}?" for i in range(64)]
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        responses = list(executor.map(lambda cq: request(server, "/complexity", {"cq": cq}), cqs))
+
+    assert all(status == 200 for status, _ in responses)
+    assert [body[0]["c0_length"] for _, body in responses] == [len(cq) for cq in cqs]
+    _, metrics = request(server, "/metrics")
+    assert metrics["mean_batch_size"]["complexity"] > 1
+
+
+def test_score_returns_requested_measures(server):
+    status, body = request(server, "/score", {"cqs": ["What is an item?"],
+                                              "measures": ["readability", "novelty"]})
+    assert status == 200
+    assert body == [{"cq": "What is an item?", "readability": {"read_words": 4},
+                     "novelty": {"novel": True}}]
+
+
+@pytest.mark.parametrize("payload", [
+    {"cqs": "What is an item?"},
+    {"cqs": []},
+    {"cqs": ["What is an item?", 3]},
+    {"cq": ["What is an item?"]},
+    {"cqs": ["What is an item?"], "measures": "readability"},
+    {"cqs": ["What is an item?"], "measures": ["fluency"]},
+    ["What is an item?"],
+])
+def test_invalid_payloads_are_rejected(server, payload):
+    status, body = request(server, "/score", payload)
+    assert status == 400
+    assert "error" in body
+
+
+def test_failing_cq_only_fails_its_own_request(server):
+    cqs = ["What is an item?", "boom", "Who owns an item?"]
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        responses = list(executor.map(lambda cq: request(server, "/readability", {"cq": cq}), cqs))
+    assert [status for status, _ in responses] == [200, 500, 200]
+
+
+def test_metrics_report_latency_percentiles(server):
+    for _ in range(5):
+        request(server, "/relevance", {"cq": "What is an item?"})
+    request(server, "/relevance", {"cqs": "What is an item?"})
+
+    status, metrics = request(server, "/metrics")
+    assert status == 200
+    latency = metrics["latency"]["relevance"]
+    assert latency["count"] == 6
+    assert latency["errors"] == 1
+    assert 0 <= latency["p50_ms"] <= latency["p99_ms"]
+
+
+def test_reload_swaps_models_version(server):
+    _, health = request(server, "/health")
+    models = server.service.models
+    status, body = request(server, "/reload", {})
+    assert status == 200 and body == {"reloading": True}
+
+    deadline = time.monotonic() + 5
+    while server.service.version == health["version"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    _, reloaded = request(server, "/health")
+    assert reloaded["version"] == health["version"] + 1
+    assert server.service.models is not models
+
+
+def test_batcher_survives_system_exit():
+    def batch_fn(items):
+        raise SystemExit()
+
+    batcher = MicroBatcher(batch_fn, max_wait_ms=1.0)
+    with pytest.raises(RuntimeError):
+        batcher.submit("What is an item?").result(timeout=5)
+    assert batcher._worker.is_alive()